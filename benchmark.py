@@ -0,0 +1,337 @@
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import pygame
+import game_09_challenge as game_09
+from crowd import Crowd
+
+
+BLOCK_COUNTS = [4, 100, 1000, 10000]
+PLAYER_COUNTS = [2, 8, 32, 64]
+MOVEMENTS = ["idle", "walking", "jumping"]
+MOVING_COUNTS = [0]
+# A Crowd checks every robot against every block at once, so it is only
+# timed on the smaller levels.
+CROWD_COUNTS = [1000, 5000]
+CROWD_BLOCK_COUNTS = [4, 100]
+# Stepping thousands of Players one at a time is slow, so they are timed for
+# fewer frames and compared per robot step.
+CROWD_PLAYER_FRAMES = 20
+
+# Every benchmark player uses the same keys, so one KeyState moves them all.
+MOVE_LEFT_KEY = pygame.K_a
+MOVE_RIGHT_KEY = pygame.K_d
+JUMP_KEY = pygame.K_w
+MOVEMENT_KEYS = {
+    "idle": game_09.KeyState(),
+    "walking": game_09.KeyState([MOVE_RIGHT_KEY]),
+    "jumping": game_09.KeyState([MOVE_RIGHT_KEY, JUMP_KEY]),
+}
+
+# Players start in rows above the floor, and the top row needs this long to
+# land (64 players make 6 rows, which fall at Player.GRAVITY per step)
+SETTLE_STEPS = 100
+
+# Extra platforms are laid out in rows above the floor, stretching to the
+# right as far as they need to go.
+PLATFORM_WIDTH = 40
+PLATFORM_HEIGHT = 10
+PLATFORM_SPACING_X = 120
+PLATFORM_SPACING_Y = 90
+PLATFORM_ROWS = 7
+# Moving platforms slide this far to the right and back
+PLATFORM_TRAVEL = PLATFORM_SPACING_X // 2
+
+
+def platform_blocks(display: game_09.Display, count: int, moving: int = 0):
+    """The first moving platforms slide back and forth, the rest stay still."""
+    blocks = []
+    for i in range(count):
+        column = i // PLATFORM_ROWS
+        row = i % PLATFORM_ROWS
+        x = column * PLATFORM_SPACING_X + (row % 2) * PLATFORM_SPACING_X // 2
+        y = display.height - 100 - row * PLATFORM_SPACING_Y
+        if i < moving:
+            path = [(x + PLATFORM_TRAVEL, y - PLATFORM_HEIGHT), (x, y - PLATFORM_HEIGHT)]
+            blocks.append(game_09.PathBlock(x=x, y=y, width=PLATFORM_WIDTH, height=PLATFORM_HEIGHT,
+                                            color=game_09.BLUE, path=path))
+        else:
+            blocks.append(game_09.Block(x=x, y=y, width=PLATFORM_WIDTH, height=PLATFORM_HEIGHT,
+                                        color=game_09.BLUE))
+    return blocks
+
+
+def build_level(display: game_09.Display, block_count: int, moving: int = 0) -> game_09.Level:
+    blocks = game_09.generate_blocks(display)
+    count = max(0, block_count - len(blocks))
+    blocks.extend(platform_blocks(display, count, min(moving, count)))
+    return game_09.Level(blocks)
+
+
+def build_players(display: game_09.Display, count: int):
+    """Lines players up a player's width apart along the floor, on both sides
+    of the middle wall. When the floor is full the next players start one
+    player higher up, so they land on each other's heads instead of starting
+    inside each other."""
+    width = game_09.PLAYER_IDLE_IMG.get_width()
+    height = game_09.PLAYER_IDLE_IMG.get_height()
+    wall_left = display.width // 2
+    wall_right = wall_left + 20
+    columns = [x for x in range(10, display.width - width, width)
+               if x + width <= wall_left or x >= wall_right]
+    players = []
+    for i in range(count):
+        player = game_09.Player(display, MOVE_LEFT_KEY, MOVE_RIGHT_KEY, JUMP_KEY)
+        player.x = columns[i % len(columns)]
+        player.y = 10 - (i // len(columns)) * height
+        players.append(player)
+    return players
+
+
+# Stands in for pygame.Rect while counting how many rects the game creates.
+class CountingRect(pygame.Rect):
+    created = 0
+
+    def __init__(self, *args):
+        CountingRect.created = CountingRect.created + 1
+        super().__init__(*args)
+
+
+def count_rects(function, repeat: int):
+    """Returns how many pygame.Rect objects function creates per call."""
+    original = pygame.Rect
+    pygame.Rect = CountingRect
+    CountingRect.created = 0
+    try:
+        for i in range(repeat):
+            function()
+    finally:
+        pygame.Rect = original
+    return CountingRect.created / repeat
+
+
+def summarize(samples):
+    """Returns mean, p50, p95 and max of samples (in seconds) as microseconds."""
+    ordered = sorted(samples)
+    count = len(ordered)
+    return {
+        "calls": count,
+        "mean_us": sum(ordered) / count * 1e6,
+        "p50_us": ordered[count // 2] * 1e6,
+        "p95_us": ordered[min(count - 1, int(count * 0.95))] * 1e6,
+        "max_us": ordered[-1] * 1e6,
+    }
+
+
+def time_calls(function, repeat: int):
+    samples = []
+    clock = time.perf_counter
+    for i in range(repeat):
+        start = clock()
+        function()
+        samples.append(clock() - start)
+    return samples
+
+
+def run_scenario(game: game_09.Game, block_count: int, player_count: int,
+                 movement: str, frames: int, moving: int = 0):
+    display = game.display
+    start = time.perf_counter()
+    game.level = build_level(display, block_count, moving)
+    build_time = time.perf_counter() - start
+    game.reset_players(build_players(display, player_count))
+    pressed_keys = MOVEMENT_KEYS[movement]
+    index = game.collisions
+
+    # Let everyone land on the floor before we start measuring
+    for i in range(SETTLE_STEPS):
+        game.update(pressed_keys)
+
+    start = time.perf_counter()
+    for i in range(frames):
+        game.update(pressed_keys)
+    elapsed = time.perf_counter() - start
+
+    update_samples = []
+    set_x_samples = []
+    set_y_samples = []
+    clock = time.perf_counter
+    for i in range(frames):
+        for player in game.players:
+            player.refresh_rect()
+        game.sweep.update()
+        for player in game.players:
+            start = clock()
+            player.update(pressed_keys, index)
+            update_samples.append(clock() - start)
+        for player in game.players:
+            start = clock()
+            player.set_x(player.x, index)
+            set_x_samples.append(clock() - start)
+            start = clock()
+            player.set_y(player.y, index)
+            set_y_samples.append(clock() - start)
+
+    rects_per_frame = count_rects(lambda: game.update(pressed_keys), 20)
+
+    return {
+        "blocks": len(game.level.blocks),
+        "moving_blocks": len(game.level.moving),
+        "players": player_count,
+        "movement": movement,
+        "frames": frames,
+        "steps_per_second": frames / elapsed if elapsed > 0 else 0,
+        "level_build_ms": build_time * 1000,
+        "player_update": summarize(update_samples),
+        "player_set_x": summarize(set_x_samples),
+        "player_set_y": summarize(set_y_samples),
+        "rects_per_frame": rects_per_frame,
+        "rects_per_player_update": rects_per_frame / player_count,
+    }
+
+
+def run_crowd(display: game_09.Display, block_count: int, robot_count: int, movement: str,
+              frames: int):
+    """Times a Crowd of robots against the same number of Players. Crowd
+    robots don't bump into each other, so the Players only get the level's
+    blocks to bump into too."""
+    level = build_level(display, block_count)
+    pressed_keys = MOVEMENT_KEYS[movement]
+    move_right = [pressed_keys[MOVE_RIGHT_KEY]] * robot_count
+    move_left = [pressed_keys[MOVE_LEFT_KEY]] * robot_count
+    jump = [pressed_keys[JUMP_KEY]] * robot_count
+
+    # Nobody bumps into anybody else, so they can all start in the same place
+    players = [game_09.Player(display, MOVE_LEFT_KEY, MOVE_RIGHT_KEY, JUMP_KEY)
+               for i in range(robot_count)]
+    crowd = Crowd(level.blocks, robot_count, players[0].player_width, players[0].player_height)
+    crowd_samples = time_calls(lambda: crowd.update(move_right, move_left, jump), frames)
+
+    index = game_09.CollisionIndex(level.index, game_09.PlayerSweep())
+
+    def update_players():
+        for player in players:
+            player.update(pressed_keys, index)
+
+    player_samples = time_calls(update_players, min(frames, CROWD_PLAYER_FRAMES))
+    crowd_step = sum(crowd_samples) / len(crowd_samples)
+    player_step = sum(player_samples) / len(player_samples)
+    return {
+        "blocks": len(level.blocks),
+        "robots": robot_count,
+        "movement": movement,
+        "frames": frames,
+        "crowd_update": summarize(crowd_samples),
+        "players_update": summarize(player_samples),
+        "crowd_robot_steps_per_second": robot_count / crowd_step if crowd_step > 0 else 0,
+        "player_robot_steps_per_second": robot_count / player_step if player_step > 0 else 0,
+    }
+
+
+def run_render(renderer: str, frames: int):
+    """Times Game.render with one renderer while the demo script plays."""
+    game = game_09.Game(headless=True, renderer=renderer)
+    samples = []
+    clock = time.perf_counter
+    for pressed_keys in game_09.scripted_keys(game_09.DEMO_SCRIPT, frames):
+        game.update(pressed_keys)
+        start = clock()
+        game.render(0.5)
+        samples.append(clock() - start)
+    return {
+        "renderer": renderer,
+        "display": type(game.display).__name__,
+        "frames": frames,
+        "render": summarize(samples),
+    }
+
+
+def git_commit():
+    try:
+        output = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True)
+    except OSError:
+        return None
+    return output.stdout.strip() or None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Player physics and collisions")
+    parser.add_argument("--frames", type=int, default=200,
+                        help="frames to measure in each scenario")
+    parser.add_argument("--blocks", type=int, nargs="+", default=BLOCK_COUNTS)
+    parser.add_argument("--players", type=int, nargs="+", default=PLAYER_COUNTS)
+    parser.add_argument("--movements", nargs="+", choices=MOVEMENTS, default=MOVEMENTS)
+    parser.add_argument("--moving", type=int, nargs="+", default=MOVING_COUNTS,
+                        help="how many of the platforms move back and forth")
+    parser.add_argument("--crowd", type=int, nargs="*", default=CROWD_COUNTS,
+                        help="how many robots to step with a Crowd and with Players")
+    parser.add_argument("--crowd-blocks", type=int, nargs="+", default=CROWD_BLOCK_COUNTS,
+                        help="level sizes to time the Crowd on")
+    parser.add_argument("--renderers", nargs="*", choices=game_09.RENDERERS, default=game_09.RENDERERS,
+                        help="renderers to compare frame times for")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    game = game_09.Game(headless=True)
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "pygame": pygame.version.ver,
+        "machine": platform.machine(),
+        "generate_blocks": summarize(time_calls(lambda: game_09.generate_blocks(game.display), 1000)),
+        "scenarios": [],
+        "crowds": [],
+        "renderers": [],
+    }
+    for block_count in args.blocks:
+        # Only the extra platforms can move, so asking for more moving ones
+        # than that would just run the same scenario again
+        platforms = max(0, block_count - len(game_09.generate_blocks(game.display)))
+        moving_counts = []
+        for moving in args.moving:
+            moving = min(moving, platforms)
+            if moving not in moving_counts:
+                moving_counts.append(moving)
+        for moving in moving_counts:
+            for player_count in args.players:
+                for movement in args.movements:
+                    scenario = run_scenario(game, block_count, player_count, movement, args.frames,
+                                            moving)
+                    print("%6d blocks %4d moving %3d players %-8s %10.0f steps/s"
+                          "  update p50 %6.1f us  %5.1f rects/player" % (
+                              scenario["blocks"], scenario["moving_blocks"], player_count, movement,
+                              scenario["steps_per_second"], scenario["player_update"]["p50_us"],
+                              scenario["rects_per_player_update"]), file=sys.stderr)
+                    results["scenarios"].append(scenario)
+
+    for block_count in args.crowd_blocks:
+        for robot_count in args.crowd:
+            for movement in args.movements:
+                result = run_crowd(game.display, block_count, robot_count, movement, args.frames)
+                print("%6d blocks %5d robots %-8s  crowd %10.0f robot steps/s"
+                      "  players %10.0f robot steps/s" % (
+                          result["blocks"], robot_count, movement,
+                          result["crowd_robot_steps_per_second"],
+                          result["player_robot_steps_per_second"]), file=sys.stderr)
+                results["crowds"].append(result)
+
+    for renderer in args.renderers:
+        result = run_render(renderer, args.frames)
+        print("%-8s renderer (%s)  render p50 %6.2f ms  p95 %6.2f ms" % (
+            renderer, result["display"], result["render"]["p50_us"] / 1000,
+            result["render"]["p95_us"] / 1000), file=sys.stderr)
+        results["renderers"].append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import pygame
+
+
+# The Camera is the part of the world that shows up in the window. It
+# follows the players around so levels can be much bigger than the window.
+# Everything is drawn shifted by the camera's position.
+class Camera:
+    def __init__(self, width: int, height: int):
+        self.rect = pygame.Rect(0, 0, width, height)
+        # The camera never shows anything outside the world
+        self.world = pygame.Rect(0, 0, width, height)
+
+    @property
+    def x(self):
+        return self.rect.x
+
+    @property
+    def y(self):
+        return self.rect.y
+
+    def follow(self, players, alpha: float = 1):
+        """Centers the camera between the players, as they are drawn."""
+        if len(players) == 0:
+            return
+        center_x = 0
+        center_y = 0
+        for player in players:
+            x, y = player.drawn_position(alpha)
+            center_x = center_x + x + player.player_width // 2
+            center_y = center_y + y + player.player_height // 2
+        self.rect.center = (center_x // len(players), center_y // len(players))
+        # Don't scroll past the edges of the world. A world smaller than the
+        # camera just stays in the top left corner.
+        self.rect.x = max(self.world.left, min(self.rect.x, self.world.right - self.rect.width))
+        self.rect.y = max(self.world.top, min(self.rect.y, self.world.bottom - self.rect.height))
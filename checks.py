@@ -0,0 +1,165 @@
+import random
+import sys
+import pygame
+import chunks
+import game_09_challenge as game_09
+from crowd import Crowd
+
+
+# Quick checks that the game still behaves, run without a window:
+#
+#   python checks.py
+#
+# Each check prints what it found and returns True if it passed.
+
+STANDING_STILL = game_09.KeyState()
+
+
+def build_game(blocks, standing_on) -> game_09.Game:
+    """Makes a headless game with one player standing on the block
+    standing_on, in a level made of blocks."""
+    game = game_09.Game(headless=True, humans=1)
+    game.level = game_09.Level(blocks)
+    player = game.players[0]
+    player.x = standing_on.rect.x
+    player.y = standing_on.rect.top - player.player_height
+    player.save_position()
+    game.reset_players([player])
+    return game
+
+
+def check_falling_block_floor() -> bool:
+    """A falling block drops through a floor, but the player riding it
+    should land on the floor and stay there, even when the block goes
+    back to where it started."""
+    falling = game_09.FallingBlock(100, 300, 20, 100, (0, 0, 255))
+    floor = game_09.Block(0, 600, 20, 1000, (165, 42, 42))
+    game = build_game([falling, floor], falling)
+    player = game.players[0]
+    lowest = 0
+    for step in range(400):
+        game.update(STANDING_STILL)
+        lowest = max(lowest, player.y + player.player_height)
+    passed = lowest <= floor.rect.top and player.y + player.player_height == floor.rect.top
+    print("falling block floor:", "ok" if passed else "FAILED",
+          "(lowest feet", lowest, "floor", floor.rect.top, ")")
+    return passed
+
+
+def check_elevator_ceiling() -> bool:
+    """An elevator goes up through a ceiling, but the player riding it
+    should stop under the ceiling and not be pushed through it."""
+    elevator = game_09.PathBlock(100, 700, 20, 100, (0, 0, 255), [(100, 700), (100, 300)], 3)
+    ceiling = game_09.Block(0, 400, 20, 1000, (165, 42, 42))
+    floor = game_09.Block(0, 720, 20, 1000, (165, 42, 42))
+    game = build_game([elevator, ceiling, floor], elevator)
+    player = game.players[0]
+    highest = player.player_collide_rect().top
+    for step in range(600):
+        game.update(STANDING_STILL)
+        highest = min(highest, player.player_collide_rect().top)
+    passed = highest >= ceiling.rect.bottom
+    print("elevator ceiling:", "ok" if passed else "FAILED",
+          "(highest head", highest, "ceiling", ceiling.rect.bottom, ")")
+    return passed
+
+
+def check_crowd_matches_players(count: int = 150, steps: int = 1500, seed: int = 1) -> bool:
+    """A Crowd should move its robots exactly like the same number of
+    Players pressing the same random keys. Crowd robots don't bump into each
+    other, so each Player gets an index with just the level's blocks in it."""
+    game = game_09.Game(headless=True, humans=1)
+    blocks = game_09.generate_blocks(game.display)
+    level = game_09.Level(blocks)
+    index = game_09.CollisionIndex(level.index, game_09.PlayerSweep())
+    players = []
+    for i in range(count):
+        player = game_09.Player(game.display, pygame.K_a, pygame.K_d, pygame.K_w)
+        player.x = 10
+        player.y = 10
+        players.append(player)
+    crowd = Crowd(blocks, count, players[0].player_width, players[0].player_height)
+    randomizer = random.Random(seed)
+    mismatches = 0
+    for step in range(steps):
+        move_right = [randomizer.random() < 0.5 for i in range(count)]
+        move_left = [randomizer.random() < 0.3 for i in range(count)]
+        jump = [randomizer.random() < 0.2 for i in range(count)]
+        for i, player in enumerate(players):
+            keys = [key for key, held in ((pygame.K_d, move_right[i]), (pygame.K_a, move_left[i]),
+                                          (pygame.K_w, jump[i])) if held]
+            player.update(game_09.KeyState(keys), index)
+        crowd.update(move_right, move_left, jump)
+        images = crowd.images()
+        for i, player in enumerate(players):
+            if (player.x != crowd.x[i] or player.y != crowd.y[i]
+                    or player.is_jumping != crowd.is_jumping[i]
+                    or player.player_img is not images[i]):
+                mismatches = mismatches + 1
+    passed = mismatches == 0
+    print("crowd matches players:", "ok" if passed else "FAILED",
+          "(%d robots, %d steps, %d mismatches)" % (count, steps, mismatches))
+    return passed
+
+
+def check_bots_stay_inside(bots: int = 30, steps: int = 1000) -> bool:
+    """Lots of bots start in rows and shove each other around, but none of
+    them should ever end up outside the edge walls."""
+    game = game_09.Game(headless=True, bots=bots)
+    world = game.display.camera.world
+    escaped = 0
+    for step in range(steps):
+        game.update(STANDING_STILL)
+        for player in game.players:
+            collide_rect = player.player_collide_rect()
+            if (collide_rect.left < world.left or collide_rect.right > world.right
+                    or player.y > world.bottom):
+                escaped = escaped + 1
+    passed = escaped == 0
+    print("bots stay inside:", "ok" if passed else "FAILED",
+          "(%d bots, %d steps, %d outside)" % (bots, steps, escaped))
+    return passed
+
+
+# A world of 20 x 20 chunks, each with a strip of floor, for the chunk check
+class GridChunks:
+    def __init__(self, columns: int = 20, size: int = chunks.CHUNK_SIZE):
+        self.size = size
+        self.bounds = (0, 0, columns - 1, columns - 1)
+        self.world = (0, 0, columns * size, columns * size)
+
+    def load_chunk(self, key):
+        return [(key[0] * self.size, (key[1] + 1) * self.size - 40, self.size, 40, game_09.BROWN)]
+
+
+def check_far_apart_chunks_stay_loaded(steps: int = 10) -> bool:
+    """Two players far apart need more chunks than MAX_CHUNKS between them.
+    Standing still, the streamer shouldn't keep dropping and reloading them,
+    which would change the level every step."""
+    game = game_09.Game(headless=True)
+    for player, position in zip(game.players, [(2000, 2000), (12000, 12000)]):
+        player.x, player.y = position
+    streamer = chunks.ChunkStreamer(game_09.Level(), GridChunks(), game_09.chunk_block,
+                                    threaded=False)
+    streamer.update(game.players)
+    version = streamer.level.version
+    for step in range(steps):
+        streamer.update(game.players)
+    changes = streamer.level.version - version
+    passed = changes == 0
+    print("far apart chunks stay loaded:", "ok" if passed else "FAILED",
+          "(%d level changes in %d steps, %d chunks loaded)" % (changes, steps, len(streamer.loaded)))
+    return passed
+
+
+CHECKS = [check_falling_block_floor, check_elevator_ceiling, check_crowd_matches_players,
+          check_bots_stay_inside, check_far_apart_chunks_stay_loaded]
+
+
+def main():
+    results = [check() for check in CHECKS]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+import mmap
+import queue
+import random
+import struct
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import tilemap
+
+
+# Very big worlds are split into square chunks. Only the chunks near the
+# players are kept in the level; the rest stay on disk (or aren't even made
+# yet, for generated worlds) until someone walks towards them.
+CHUNK_SIZE = 800
+# How many chunks around each player to keep loaded. Chunks one step further
+# out start loading early so they are ready by the time a player gets there.
+CHUNK_RADIUS = 1
+# The most chunks to keep in memory at once. It can't be less than the
+# (2 * radius + 3) ** 2 chunks around a player that are loaded or loading;
+# the rest hold on to chunks the players just left, so walking back doesn't
+# load them again. Players far apart each need their own ring, so then more
+# chunks than this can be loaded.
+MAX_CHUNKS = 36
+
+# A block in a chunk is (x, y, width, height, (r, g, b)), with x and y the
+# top left corner in world coordinates.
+BlockData = Tuple[int, int, int, int, Tuple[int, int, int]]
+
+# A chunk file is a header (which includes the world's size in pixels), a
+# table saying where each chunk's blocks start, then every chunk's blocks
+# one after another.
+CHUNK_MAGIC = b"CHNK"
+CHUNK_VERSION = 1
+CHUNK_HEADER = struct.Struct("<4sIIIiiii")
+CHUNK_ENTRY = struct.Struct("<iiQI")
+CHUNK_BLOCK = struct.Struct("<iiiiBBBx")
+EDGE_COLOR = (0, 0, 255)
+
+
+def chunk_key(x: int, y: int, size: int = CHUNK_SIZE):
+    return (x // size, y // size)
+
+
+def split_blocks(blocks: List[BlockData], size: int = CHUNK_SIZE) -> Dict[tuple, List[BlockData]]:
+    """Cuts blocks along chunk edges so that every chunk holds only its own
+    pieces, and returns the pieces grouped by chunk."""
+    chunks = {}
+    for x, y, width, height, color in blocks:
+        first_column, first_row = chunk_key(x, y, size)
+        last_column, last_row = chunk_key(x + width - 1, y + height - 1, size)
+        for column in range(first_column, last_column + 1):
+            for row in range(first_row, last_row + 1):
+                left = max(x, column * size)
+                top = max(y, row * size)
+                right = min(x + width, (column + 1) * size)
+                bottom = min(y + height, (row + 1) * size)
+                chunks.setdefault((column, row), []).append((left, top, right - left, bottom - top, color))
+    return chunks
+
+
+def write_chunk_file(path: str, blocks: List[BlockData], world: Tuple[int, int, int, int],
+                     size: int = CHUNK_SIZE):
+    """Saves blocks as a chunk file. world is the (x, y, width, height) the
+    camera is allowed to show."""
+    chunks = split_blocks(blocks, size)
+    offset = CHUNK_HEADER.size + CHUNK_ENTRY.size * len(chunks)
+    with open(path, "wb") as f:
+        f.write(CHUNK_HEADER.pack(CHUNK_MAGIC, CHUNK_VERSION, size, len(chunks), *world))
+        for key, chunk in chunks.items():
+            f.write(CHUNK_ENTRY.pack(key[0], key[1], offset, len(chunk)))
+            offset = offset + CHUNK_BLOCK.size * len(chunk)
+        for chunk in chunks.values():
+            for x, y, width, height, color in chunk:
+                f.write(CHUNK_BLOCK.pack(x, y, width, height, *color))
+
+
+# Reads chunks straight out of a memory-mapped chunk file. Only the small
+# table of where each chunk is gets read up front.
+class ChunkFile:
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.size, count, *world = CHUNK_HEADER.unpack_from(self.buffer, 0)
+        if magic != CHUNK_MAGIC or version != CHUNK_VERSION:
+            raise ValueError(path + " is not a chunk file")
+        self.world = tuple(world)
+        self.entries = {}
+        for i in range(count):
+            column, row, offset, block_count = CHUNK_ENTRY.unpack_from(
+                self.buffer, CHUNK_HEADER.size + i * CHUNK_ENTRY.size)
+            self.entries[(column, row)] = (offset, block_count)
+        # The area covered by the chunks, in chunk coordinates
+        columns = [key[0] for key in self.entries]
+        rows = [key[1] for key in self.entries]
+        self.bounds = (min(columns), min(rows), max(columns), max(rows))
+
+    def load_chunk(self, key) -> List[BlockData]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return []
+        offset, block_count = entry
+        blocks = []
+        for x, y, width, height, r, g, b in CHUNK_BLOCK.iter_unpack(
+                self.buffer[offset:offset + block_count * CHUNK_BLOCK.size]):
+            blocks.append((x, y, width, height, (r, g, b)))
+        return blocks
+
+
+# Makes up chunks as they are needed. The same seed always makes the same
+# world, and each chunk only depends on the seed and where it is, so chunks
+# can be thrown away and made again later.
+class GeneratedChunks:
+    FLOOR_HEIGHT = 40
+    WALL_WIDTH = 20
+    PLATFORM_HEIGHT = 20
+    FLOOR_COLOR = (165, 42, 42)
+    PLATFORM_COLOR = (0, 0, 255)
+
+    def __init__(self, seed: int, columns: int, size: int = CHUNK_SIZE):
+        self.seed = seed
+        self.size = size
+        # Generated worlds are one chunk tall and this many chunks wide
+        self.bounds = (0, 0, columns - 1, 0)
+        self.world = (0, 0, columns * size, size)
+
+    def load_chunk(self, key) -> List[BlockData]:
+        column, row = key
+        left, top, right, bottom = self.bounds
+        if column < left or column > right or row != 0:
+            return []
+        rng = random.Random(self.seed * 1000003 + column)
+        size = self.size
+        x = column * size
+        blocks = [(x, size - self.FLOOR_HEIGHT, size, self.FLOOR_HEIGHT, self.FLOOR_COLOR)]
+        if column == left:
+            blocks.append((x, 0, self.WALL_WIDTH, size, self.FLOOR_COLOR))
+        if column == right:
+            blocks.append((x + size - self.WALL_WIDTH, 0, self.WALL_WIDTH, size, self.FLOOR_COLOR))
+        for i in range(rng.randint(2, 5)):
+            width = rng.randint(3, 8) * 20
+            platform_x = x + rng.randint(1, (size - width) // 20 - 1) * 20
+            platform_y = size - self.FLOOR_HEIGHT - rng.randint(3, 12) * 20
+            blocks.append((platform_x, platform_y, width, self.PLATFORM_HEIGHT, self.PLATFORM_COLOR))
+        return blocks
+
+
+# Keeps the chunks near the players loaded into a Level. Chunks are loaded
+# on a background thread so the game never waits for the disk, and when too
+# many are loaded the one that was needed least recently is dropped.
+class ChunkStreamer:
+    def __init__(self, level, source, make_block, radius: int = CHUNK_RADIUS,
+                 max_chunks: int = MAX_CHUNKS, threaded: bool = True):
+        self.level = level
+        self.source = source
+        # Turns a BlockData into whatever the level stores
+        self.make_block = make_block
+        self.radius = radius
+        ring = (2 * radius + 3) ** 2
+        if max_chunks < ring:
+            raise ValueError("max_chunks has to be at least %d when radius is %d" % (ring, radius))
+        self.max_chunks = max_chunks
+        # Loaded chunks, least recently needed first
+        self.loaded = OrderedDict()
+        self.pending = set()
+        self.threaded = threaded
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        if threaded:
+            self.thread = threading.Thread(target=self.load_forever, daemon=True)
+            self.thread.start()
+
+    def load_forever(self):
+        while True:
+            key = self.requests.get()
+            self.results.put((key, self.load_blocks(key)))
+
+    def load_blocks(self, key):
+        return [self.make_block(*block) for block in self.source.load_chunk(key)]
+
+    def wanted_chunks(self, players, radius: int):
+        size = self.source.size
+        left, top, right, bottom = self.source.bounds
+        wanted = []
+        for player in players:
+            column, row = chunk_key(player.x + player.player_width // 2,
+                                    player.y + player.player_height // 2, size)
+            for c in range(max(left, column - radius), min(right, column + radius) + 1):
+                for r in range(max(top, row - radius), min(bottom, row + radius) + 1):
+                    if (c, r) not in wanted:
+                        wanted.append((c, r))
+        return wanted
+
+    def load_now(self, players):
+        """Loads the chunks around the players straight away. Use this before
+        the game starts so nobody falls through a chunk that isn't there yet."""
+        for key in self.wanted_chunks(players, self.radius):
+            if key not in self.loaded:
+                self.add_chunk(key, self.load_blocks(key))
+
+    def update(self, players):
+        # Add chunks that finished loading
+        while True:
+            try:
+                key, blocks = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.pending.discard(key)
+            if key not in self.loaded:
+                self.add_chunk(key, blocks)
+
+        needed = self.wanted_chunks(players, self.radius)
+        for key in needed:
+            if key in self.loaded:
+                self.loaded.move_to_end(key)
+        # Ask for the chunks we need now plus the ring around them
+        wanted = self.wanted_chunks(players, self.radius + 1)
+        for key in wanted:
+            if key in self.loaded or key in self.pending:
+                continue
+            if self.threaded:
+                self.pending.add(key)
+                self.requests.put(key)
+            else:
+                self.add_chunk(key, self.load_blocks(key))
+
+        if len(self.loaded) > self.max_chunks:
+            # Drop the chunks that were needed least recently. Chunks around
+            # a player are never dropped, even if the players are so far
+            # apart that their rings add up to more than max_chunks, or they
+            # would just be asked for again next step.
+            keep = set(wanted)
+            for key in [key for key in self.loaded if key not in keep]:
+                if len(self.loaded) <= self.max_chunks:
+                    break
+                self.level.remove_blocks(self.loaded.pop(key))
+
+    def add_chunk(self, key, blocks):
+        self.loaded[key] = blocks
+        self.level.add_blocks(blocks)
+
+
+def tilemap_chunk_blocks(tiles: tilemap.TileMap) -> List[BlockData]:
+    """The same blocks game_09_challenge.tilemap_blocks makes, as BlockData."""
+    blocks = []
+    for rect, tile in tiles.merged_rects():
+        blocks.append((rect.x, rect.y, rect.width, rect.height, tiles.legend[tile]))
+    # Left and right edges to prevent player from falling to infinity
+    blocks.append((-100, 0, 100, tiles.height, EDGE_COLOR))
+    blocks.append((tiles.width, 0, 100, tiles.height, EDGE_COLOR))
+    return blocks
+
+
+# Running this file turns a tile map level into a chunk file:
+#   python chunks.py levels/long_run.json levels/long_run.chunks
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("usage: python chunks.py LEVEL.json OUTPUT.chunks")
+    level_tiles = tilemap.load(sys.argv[1])
+    write_chunk_file(sys.argv[2], tilemap_chunk_blocks(level_tiles),
+                     (0, 0, level_tiles.width, level_tiles.height))
+    print("Wrote " + sys.argv[2])
@@ -0,0 +1,198 @@
+import numpy as np
+import game_09_challenge as game_09
+from game_09_challenge import Player
+
+
+# A Crowd is lots of robots stepped all at once. Instead of one Player object
+# per robot, it keeps one NumPy array per piece of state (all the x positions
+# in one array, all the y positions in another, ...) and updates every robot
+# with a handful of array operations. The rules are exactly the ones in
+# Player.update, except that crowd robots only bump into the level's blocks,
+# not into each other or into players.
+#
+# The game itself doesn't use a Crowd. It is here to measure how much faster
+# stepping robots in arrays can be: benchmark.py times it against Players,
+# and checks.py makes sure it still moves them exactly like Players do.
+class Crowd:
+    def __init__(self, blocks, count: int, player_width: int, player_height: int):
+        rects = [block.rect for block in blocks]
+        self.block_left = np.array([rect.left for rect in rects], dtype=np.int64)
+        self.block_right = np.array([rect.right for rect in rects], dtype=np.int64)
+        self.block_top = np.array([rect.top for rect in rects], dtype=np.int64)
+        self.block_bottom = np.array([rect.bottom for rect in rects], dtype=np.int64)
+        self.block_center_x = np.array([rect.centerx for rect in rects], dtype=np.int64)
+        self.block_center_y = np.array([rect.centery for rect in rects], dtype=np.int64)
+
+        # The same sizes Player uses for its collide and feet rects
+        self.player_width = player_width
+        self.player_height = player_height
+        self.collide_width = player_width - Player.COLLIDE_INSET
+        self.collide_edge = int((player_width - self.collide_width) / 2)
+        self.collide_top = Player.COLLIDE_TOP
+        self.collide_height = player_height - self.collide_top
+        self.feet_width = player_width - Player.FEET_INSET
+        self.feet_edge = int((player_width - self.feet_width) / 2)
+
+        self.x = np.full(count, 10, dtype=np.int64)
+        self.y = np.full(count, 10, dtype=np.int64)
+        self.jumping_velocity = np.full(count, game_09.JUMP_START_VELOCITY, dtype=np.int64)
+        self.jumping_mass = Player.JUMP_MASS
+        self.is_jumping = np.zeros(count, dtype=bool)
+        self.is_falling = np.zeros(count, dtype=bool)
+        self.last_move = np.full(count, Player.IDLE, dtype=np.int64)
+        self.last_move_repeat_count = np.zeros(count, dtype=np.int64)
+        # Which robots were jumping during the last step. Player picks its
+        # jumping image based on this even if it landed during the step.
+        self.jumped = np.zeros(count, dtype=bool)
+
+    def __len__(self):
+        return len(self.x)
+
+    def change_last_move(self, rows, last_move: int):
+        same = rows & (self.last_move == last_move)
+        changed = rows & ~same
+        self.last_move_repeat_count[same] = self.last_move_repeat_count[same] + 1
+        self.last_move[changed] = last_move
+        self.last_move_repeat_count[changed] = 0
+
+    def overlaps(self, left, top, width: int, height: int):
+        """Returns a (robots x blocks) array that is True where the rect of
+        each robot overlaps each block, like pygame.Rect.colliderect."""
+        return ((left[:, None] < self.block_right) & (self.block_left < left[:, None] + width) &
+                (top[:, None] < self.block_bottom) & (self.block_top < top[:, None] + height))
+
+    def blocks_contain(self, x, y):
+        """Like block.rect.collidepoint((x, y)) for every robot and block."""
+        return ((self.block_left <= x[:, None]) & (x[:, None] < self.block_right) &
+                (self.block_top <= y[:, None]) & (y[:, None] < self.block_bottom))
+
+    def rects_contain(self, left, top, width: int, height: int, x, y):
+        """Like rect.collidepoint((x, y)) for every robot's rect and every
+        block's point x, y."""
+        return ((left[:, None] <= x) & (x < left[:, None] + width) &
+                (top[:, None] <= y) & (y < top[:, None] + height))
+
+    def set_y(self, y, rows):
+        """Sets y for the robots in rows, landing them on any block under their feet."""
+        index = np.nonzero(rows)[0]
+        if len(index) == 0:
+            return
+        new_y = y[index]
+        feet_left = self.x[index] + self.feet_edge
+        hits = self.overlaps(feet_left, new_y + self.player_height, self.feet_width, 1)
+        landed = hits.any(axis=1)
+        # collidelist gives us the first block in the list that is hit
+        first_hit = hits.argmax(axis=1)
+        new_y = np.where(landed, self.block_top[first_hit] - self.player_height, new_y)
+        self.y[index] = new_y
+        landed_index = index[landed]
+        self.is_jumping[landed_index] = False
+        self.is_falling[landed_index] = False
+        self.is_falling[index[~landed]] = True
+
+    def set_x(self, x, rows):
+        """Sets x for the robots in rows, stopping them at any walls."""
+        index = np.nonzero(rows)[0]
+        if len(index) == 0:
+            return
+        left = x[index] + self.collide_edge
+        top = self.y[index] + self.collide_top
+        width = self.collide_width
+        height = self.collide_height
+        right = left + width
+        bottom = top + height
+        middle = top + height // 2
+        hits = self.overlaps(left, top, width, height)
+
+        right_hits = hits & (self.blocks_contain(right, top) |
+                             self.blocks_contain(right, bottom) |
+                             self.blocks_contain(right, middle) |
+                             self.rects_contain(left, top, width, height,
+                                                self.block_left, self.block_center_y))
+        left_hits = hits & (self.blocks_contain(left, top) |
+                            self.blocks_contain(left, bottom) |
+                            self.blocks_contain(left, middle) |
+                            self.rects_contain(left, top, width, height,
+                                               self.block_right, self.block_center_y))
+        max_right = np.minimum(right, np.where(right_hits, self.block_left, right[:, None]).min(axis=1))
+        min_left = np.maximum(left, np.where(left_hits, self.block_right, left[:, None]).max(axis=1))
+
+        right_buffer = self.player_width - self.collide_edge - self.collide_width
+        new_x = np.where(max_right < right, max_right - self.player_width + right_buffer,
+                         np.where(min_left > left, min_left - self.collide_edge, x[index]))
+        self.x[index] = new_x
+
+    def hits_ceiling(self, rows):
+        """Returns which of the robots in rows have bumped their head."""
+        index = np.nonzero(rows)[0]
+        result = np.zeros(len(self), dtype=bool)
+        if len(index) == 0:
+            return result
+        left = self.x[index] + self.collide_edge
+        top = self.y[index] + self.collide_top
+        width = self.collide_width
+        height = self.collide_height
+        hits = self.overlaps(left, top, width, height)
+        top_hits = hits & (self.blocks_contain(left + width, top) |
+                           self.blocks_contain(left, top) |
+                           self.blocks_contain(left + width // 2, top) |
+                           self.rects_contain(left, top, width, height,
+                                              self.block_center_x, self.block_bottom))
+        result[index] = top_hits.any(axis=1)
+        return result
+
+    def update(self, move_right, move_left, jump):
+        """Runs one physics step. Each argument is an array of booleans with
+        one entry per robot saying whether that key is held down."""
+        move_right = np.asarray(move_right, dtype=bool)
+        move_left = np.asarray(move_left, dtype=bool)
+        jump = np.asarray(jump, dtype=bool)
+        # Pressing left and right at the same time cancels both
+        going_right = move_right & ~move_left
+        going_left = move_left & ~move_right
+        self.change_last_move(~going_right & ~going_left & ~jump, Player.IDLE)
+
+        step = np.where(going_right, Player.VELOCITY, np.where(going_left, -Player.VELOCITY, 0))
+        self.set_x(self.x + step, going_right | going_left)
+        self.change_last_move(going_right, Player.MOVE_RIGHT)
+        self.change_last_move(going_left, Player.MOVE_LEFT)
+
+        start_jump = jump & ~self.is_falling & ~self.is_jumping
+        self.is_jumping[start_jump] = True
+        self.jumping_velocity[start_jump] = game_09.JUMP_START_VELOCITY
+
+        jumping = self.is_jumping.copy()
+        self.jumped = jumping
+        force = self.jumping_mass * self.jumping_velocity
+        force = np.where(force + Player.MAX_FORCE < 0, -Player.MAX_FORCE, force)
+        self.set_y(self.y - force, jumping)
+        self.jumping_velocity[jumping] = self.jumping_velocity[jumping] - 1
+        self.jumping_velocity[self.hits_ceiling(jumping & (force > 0))] = 0
+
+        # Robots that aren't jumping fall if there is no ground under them
+        standing = np.nonzero(~jumping)[0]
+        if len(standing) > 0:
+            feet_left = self.x[standing] + self.feet_edge
+            feet_top = self.y[standing] + self.player_height
+            on_ground = self.overlaps(feet_left, feet_top, self.feet_width, 1).any(axis=1)
+            falling = np.zeros(len(self), dtype=bool)
+            falling[standing[~on_ground]] = True
+            self.set_y(self.y + Player.GRAVITY, falling)
+
+    def images(self):
+        """Returns the image each robot should be drawn with, like Player.update picks."""
+        walking_index = (self.last_move_repeat_count // 2) % 8
+        images = []
+        for i in range(len(self)):
+            if self.jumped[i]:
+                if self.last_move[i] == Player.MOVE_LEFT:
+                    images.append(game_09.PLAYER_JUMP_LEFT)
+                else:
+                    images.append(game_09.PLAYER_JUMP_RIGHT)
+            elif self.last_move[i] == Player.IDLE:
+                images.append(game_09.PLAYER_IDLE_IMG)
+            elif self.last_move[i] == Player.MOVE_LEFT:
+                images.append(game_09.PLAYER_WALKING_LEFT[walking_index[i]])
+            else:
+                images.append(game_09.PLAYER_WALKING_RIGHT[walking_index[i]])
+        return images
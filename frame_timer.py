@@ -0,0 +1,111 @@
+import time
+import pygame
+
+
+# How many frames of timings we remember
+FRAME_HISTORY = 300
+# How often (in frames) the overlay text is redrawn. Drawing text is slow, so
+# we don't do it every frame.
+OVERLAY_REFRESH = 15
+OVERLAY_COLOR = (0, 0, 0)
+OVERLAY_BACKGROUND = (255, 255, 255)
+OVERLAY_NAME_WIDTH = 90
+OVERLAY_COLUMN_WIDTH = 55
+
+
+# A FrameTimer measures how long each phase of the main loop takes. The loop
+# calls start_frame() at the top, mark(phase) after each phase, and
+# end_frame() at the bottom. Timings go into a ring buffer: a fixed-size list
+# per phase where the newest frame overwrites the oldest one.
+#
+# When the timer is turned off, every method returns straight away so it
+# costs next to nothing.
+class FrameTimer:
+    def __init__(self, phases, size: int = FRAME_HISTORY):
+        self.phases = list(phases)
+        self.size = size
+        self.times = {phase: [0.0] * size for phase in self.phases}
+        self.enabled = False
+        # Total number of frames recorded. frames % size is the next slot.
+        self.frames = 0
+        self.last_time = 0
+        self.font = None
+        self.overlay = None
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.overlay = None
+        if self.enabled:
+            self.frames = 0
+            # Otherwise the first mark would count all the time since the
+            # computer started
+            self.last_time = time.perf_counter()
+
+    def start_frame(self):
+        if self.enabled:
+            self.last_time = time.perf_counter()
+
+    def mark(self, phase: str):
+        """Records the time since the last mark as the time taken by phase."""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.times[phase][self.frames % self.size] = now - self.last_time
+        self.last_time = now
+
+    def end_frame(self):
+        if self.enabled:
+            self.frames = self.frames + 1
+
+    def recorded(self, phase: str):
+        """Returns the recorded times for phase, oldest first."""
+        times = self.times[phase]
+        if self.frames < self.size:
+            return times[:self.frames]
+        start = self.frames % self.size
+        return times[start:] + times[:start]
+
+    def stats(self, phase: str):
+        """Returns (p50, p95, max) in milliseconds for phase."""
+        ordered = sorted(self.recorded(phase))
+        if len(ordered) == 0:
+            return 0, 0, 0
+        count = len(ordered)
+        return (ordered[count // 2] * 1000,
+                ordered[min(count - 1, int(count * 0.95))] * 1000,
+                ordered[-1] * 1000)
+
+    def dump(self, path: str):
+        """Writes the recorded frames to a CSV file, one row per frame."""
+        columns = [self.recorded(phase) for phase in self.phases]
+        with open(path, "w") as f:
+            f.write(",".join(phase + "_ms" for phase in self.phases) + "\n")
+            for row in zip(*columns):
+                f.write(",".join("%.3f" % (t * 1000) for t in row) + "\n")
+
+    def overlay_image(self):
+        """Returns an image of the timings table, or None when the timer is off."""
+        if not self.enabled:
+            return None
+        if self.overlay is None or self.frames % OVERLAY_REFRESH == 0:
+            if self.font is None:
+                self.font = pygame.font.SysFont("monospace", 14)
+            rows = [["phase", "p50", "p95", "max ms"]]
+            for phase in self.phases:
+                rows.append([phase] + ["%.2f" % t for t in self.stats(phase)])
+            line_height = self.font.get_linesize()
+            self.overlay = pygame.Surface((OVERLAY_NAME_WIDTH + 3 * OVERLAY_COLUMN_WIDTH,
+                                           len(rows) * line_height))
+            # Renderers that draw with textures don't have a display surface to convert to
+            if pygame.display.get_surface() is not None:
+                self.overlay = self.overlay.convert()
+            self.overlay.fill(OVERLAY_BACKGROUND)
+            # Each value is drawn in its own column so they line up even if
+            # the font isn't monospaced.
+            for i, row in enumerate(rows):
+                x = 0
+                for j, text in enumerate(row):
+                    image = self.font.render(text, True, OVERLAY_COLOR, OVERLAY_BACKGROUND)
+                    self.overlay.blit(image, (x, i * line_height))
+                    x = x + (OVERLAY_NAME_WIDTH if j == 0 else OVERLAY_COLUMN_WIDTH)
+        return self.overlay
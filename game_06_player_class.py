@@ -2,8 +2,6 @@ import sys
 import pygame
 
 
-pygame.init()
-
 # frames per second
 FPS = 30
 FPS_CLOCK = pygame.time.Clock()
@@ -136,45 +134,52 @@ class Player:
     def render(self, display: Display):
         display.surface.blit(self.player_img, (self.x, self.y))
 
-display = Display()
-player = Player(display)
-
-# Main game loop that is executed FPS times per second.
-# Each time through the loop is one frame in the game.
-while True:
-    # Each time we execute a frame, we ask pygame to tell us the state of
-    # all the keyboard keys:
-    pressed_keys = pygame.key.get_pressed()
-
-    # During each frame, the user may have pressed several keys.  We collect
-    # each movement that the user indicated, and will pass those on to the
-    # player instance so it may update accordingly.
-    movements = []
-    if pressed_keys[pygame.K_RIGHT]:
-        movements.append(player.MOVE_RIGHT)
-    if pressed_keys[pygame.K_LEFT]:
-        # If both right and left keys are pressed, we just ignore both.
-        # We know that if right has been pressed, then the movements
-        # list will have a size of 1 element
-        if len(movements) == 1:
-            movements = []
-        else:
-            movements.append(player.MOVE_LEFT)
-    if pressed_keys[pygame.K_SPACE]:
-        movements.append(player.JUMP)
-
-    # Process events that have happened since the last frame:
-    for event in pygame.event.get():
-        # print(pygame.event.event_name(event.type))
-        # print(event)
-        if event.type == pygame.QUIT:
-            pygame.quit()
-            sys.exit()
-
-    # Update the display
-    display.clear()
-    player.update(movements)
-    player.render(display)
-    pygame.display.update()
-    # Use the FPS clock to maintain smooth animation
-    FPS_CLOCK.tick(FPS)
+
+def main():
+    pygame.init()
+    display = Display()
+    player = Player(display)
+
+    # Main game loop that is executed FPS times per second.
+    # Each time through the loop is one frame in the game.
+    while True:
+        # Each time we execute a frame, we ask pygame to tell us the state of
+        # all the keyboard keys:
+        pressed_keys = pygame.key.get_pressed()
+
+        # During each frame, the user may have pressed several keys.  We collect
+        # each movement that the user indicated, and will pass those on to the
+        # player instance so it may update accordingly.
+        movements = []
+        if pressed_keys[pygame.K_RIGHT]:
+            movements.append(player.MOVE_RIGHT)
+        if pressed_keys[pygame.K_LEFT]:
+            # If both right and left keys are pressed, we just ignore both.
+            # We know that if right has been pressed, then the movements
+            # list will have a size of 1 element
+            if len(movements) == 1:
+                movements = []
+            else:
+                movements.append(player.MOVE_LEFT)
+        if pressed_keys[pygame.K_SPACE]:
+            movements.append(player.JUMP)
+
+        # Process events that have happened since the last frame:
+        for event in pygame.event.get():
+            # print(pygame.event.event_name(event.type))
+            # print(event)
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                sys.exit()
+
+        # Update the display
+        display.clear()
+        player.update(movements)
+        player.render(display)
+        pygame.display.update()
+        # Use the FPS clock to maintain smooth animation
+        FPS_CLOCK.tick(FPS)
+
+
+if __name__ == "__main__":
+    main()
@@ -55,20 +55,59 @@ class Display:
         pygame.display.update()
 
 
+# __slots__ tells Python exactly which attributes a Tile has, so each one
+# takes less memory. The position lives only in the rect.
 class Tile:
     WIDTH = 50
     HEIGHT = GROUND_TILE_HEIGHT
 
+    __slots__ = ("rect", "color")
+
     def __init__(self, x: int, y: int, color: (int, int, int)):
-        self.x = x
-        self.y = y
-        self.rect = pygame.Rect(self.x, self.y, self.WIDTH, self.HEIGHT)
+        self.rect = pygame.Rect(x, y, self.WIDTH, self.HEIGHT)
         self.color = color
 
+    @property
+    def x(self):
+        return self.rect.x
+
+    @property
+    def y(self):
+        return self.rect.y
+
     def render(self, display: Display):
         pygame.draw.rect(display.surface, self.color, self.rect)
 
 
+# A Level holds all of the blocks that make up the world. We build it once
+# when the game starts instead of building new blocks every frame. Whenever
+# blocks are added or removed, the level's version goes up so anything that
+# remembers the blocks (like a drawing cache) knows it needs to catch up.
+class Level:
+    def __init__(self, blocks=None):
+        self.blocks = []
+        self.version = 0
+        if blocks is not None:
+            for block in blocks:
+                self.add(block)
+
+    def add(self, block):
+        self.blocks.append(block)
+        self.mark_dirty()
+
+    def remove(self, block):
+        self.blocks.remove(block)
+        self.mark_dirty()
+
+    def mark_dirty(self):
+        """Call this after changing a block in place so caches get rebuilt."""
+        self.version = self.version + 1
+
+    def render(self, display: Display):
+        for block in self.blocks:
+            block.render(display)
+
+
 class Player:
     IDLE = 0
     MOVE_RIGHT = 1
@@ -79,6 +118,11 @@ class Player:
     # How fast the player moves in each frame
     VELOCITY = 8
 
+    __slots__ = ("player_img", "move_left_key", "move_right_key", "jump_key",
+                 "player_width", "feet_width", "player_height", "x", "y", "velocity",
+                 "last_move", "last_move_repeat_count", "is_jumping", "is_falling",
+                 "jumping_velocity", "jumping_mass")
+
     def __init__(self, display: Display, move_left_key, move_right_key, jump_key):
         self.player_img = PLAYER_IDLE_IMG
         self.move_left_key = move_left_key
@@ -200,11 +244,6 @@ class Player:
         #pygame.draw.rect(display.surface, RED, self.feet_rect())
 
 
-display = Display()
-player1 = Player(display, pygame.K_a, pygame.K_d, pygame.K_w)
-player2 = Player(display, pygame.K_k, pygame.K_SEMICOLON, pygame.K_o)
-player2.x = display.width - player2.player_width
-
 def generate_tiles(display: Display):
     tiles = []
     # Add the floor tiles
@@ -216,28 +255,41 @@ def generate_tiles(display: Display):
     tiles.append(Tile(400, display.height - 300, BLUE))
     return tiles
 
-# Main game loop that is executed FPS times per second.
-# Each time through the loop is one frame in the game.
-while True:
-    # Each time we execute a frame, we ask pygame to tell us the state of
-    # all the keyboard keys:
-    pressed_keys = pygame.key.get_pressed()
-
-    # Process events that have happened since the last frame:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            pygame.quit()
-            sys.exit()
-
-    # Update the display
-    display.clear()
-    tiles = generate_tiles(display)
-    for tile in tiles:
-        tile.render(display)
-    player1.update(pressed_keys, tiles)
-    player1.render(display)
-    player2.update(pressed_keys, tiles)
-    player2.render(display)
-    pygame.display.update()
-    # Use the FPS clock to maintain smooth animation
-    FPS_CLOCK.tick(FPS)
+
+def main():
+    pygame.init()
+    display = Display()
+    player1 = Player(display, pygame.K_a, pygame.K_d, pygame.K_w)
+    player2 = Player(display, pygame.K_k, pygame.K_SEMICOLON, pygame.K_o)
+    player2.x = display.width - player2.player_width
+
+    # The tiles never change, so we only need to build them once.
+    level = Level(generate_tiles(display))
+
+    # Main game loop that is executed FPS times per second.
+    # Each time through the loop is one frame in the game.
+    while True:
+        # Each time we execute a frame, we ask pygame to tell us the state of
+        # all the keyboard keys:
+        pressed_keys = pygame.key.get_pressed()
+
+        # Process events that have happened since the last frame:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                sys.exit()
+
+        # Update the display
+        display.clear()
+        level.render(display)
+        player1.update(pressed_keys, level.blocks)
+        player1.render(display)
+        player2.update(pressed_keys, level.blocks)
+        player2.render(display)
+        pygame.display.update()
+        # Use the FPS clock to maintain smooth animation
+        FPS_CLOCK.tick(FPS)
+
+
+if __name__ == "__main__":
+    main()
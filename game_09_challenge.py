@@ -1,14 +1,64 @@
+import argparse
+import bisect
+import math
+import os
+import random
 import sys
+import time
 import pygame
+import chunks
+import replay
+import rewind
+import sprites
+import texture_display
+import tilemap
+from camera import Camera
+from frame_timer import FrameTimer
+from replay import KeyState
 from typing import List
 
 
-pygame.init()
-
-# frames per second
-FPS = 30
+# Frames drawn per second. This can be changed without changing how fast
+# the game plays, because the physics always runs at PHYSICS_FPS.
+FPS = 60
 FPS_CLOCK = pygame.time.Clock()
+# Physics steps per second. All the speeds in Player are "per physics step".
+PHYSICS_FPS = 30
+PHYSICS_STEP = 1 / PHYSICS_FPS
+# If a frame takes longer than this (in seconds), we stop trying to catch up
+# so a slow frame doesn't cause an even slower one.
+MAX_FRAME_TIME = 0.25
+# Only send the parts of the screen that changed to the display each frame
+DIRTY_RECTS = True
+# Check whether players touch using the pixels of their images instead of
+# their collide rects
+PIXEL_COLLISIONS = False
+# "software" draws with Surface blits, "texture" with SDL's Renderer
+RENDERERS = ["software", "texture"]
+# Press F3 to show how long each part of a frame takes, F4 to save the
+# timings to FRAME_TIMES_FILE.
+TIMER_KEY = pygame.K_F3
+TIMER_DUMP_KEY = pygame.K_F4
+FRAME_TIMES_FILE = "frame_times.csv"
+# Hold REWIND_KEY to play the game backwards, up to REWIND_SECONDS back.
+# SAVE_KEY saves the game (and its history) to SAVE_FILE and LOAD_KEY loads it.
+REWIND_KEY = pygame.K_BACKSPACE
+REWIND_SECONDS = 300
+SAVE_KEY = pygame.K_F5
+LOAD_KEY = pygame.K_F9
+SAVE_FILE = "saved_game.rwd"
+FRAME_PHASES = ["events", "physics", "background", "players", "overlay", "display"]
 JUMP_START_VELOCITY = 10
+# The keys (left, right, jump) for each player at the keyboard, in order.
+# Any players after these are bots. Change them with --keys.
+KEY_BINDINGS = [
+    (pygame.K_a, pygame.K_d, pygame.K_w),
+    (pygame.K_k, pygame.K_SEMICOLON, pygame.K_o),
+    (pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP),
+    (pygame.K_f, pygame.K_h, pygame.K_t),
+]
+# Replays remember up to replay.MAX_KEYS keys, three for each player
+MAX_KEYBOARD_PLAYERS = replay.MAX_KEYS // 3
 
 # Colors
 RED = (255, 0, 0)
@@ -16,58 +66,651 @@ YELLOW = (255, 255, 0)
 BLUE = (0, 0, 255)
 BROWN = (165, 42, 42)
 
-# When rendering the player, we use images saved in our assets directory
-PLAYER_IDLE_IMG = pygame.image.load("assets/robot/character_robot_idle.png")
-PLAYER_JUMP_RIGHT = pygame.image.load("assets/robot/character_robot_jump.png")
-PLAYER_JUMP_LEFT = pygame.transform.flip(PLAYER_JUMP_RIGHT, True, False)
-PLAYER_WALKING_RIGHT = [
-    pygame.image.load("assets/robot/character_robot_walk0.png"),
-    pygame.image.load("assets/robot/character_robot_walk1.png"),
-    pygame.image.load("assets/robot/character_robot_walk2.png"),
-    pygame.image.load("assets/robot/character_robot_walk3.png"),
-    pygame.image.load("assets/robot/character_robot_walk4.png"),
-    pygame.image.load("assets/robot/character_robot_walk5.png"),
-    pygame.image.load("assets/robot/character_robot_walk6.png"),
-    pygame.image.load("assets/robot/character_robot_walk7.png")
-]
-
 GROUND_TILE_HEIGHT = 20
-
-# Left-walking images are just flipped versions of the right-walking versions.
-# We can use pygame.transform.flip to achieve this.
-PLAYER_WALKING_LEFT = []
-for img in PLAYER_WALKING_RIGHT:
-    PLAYER_WALKING_LEFT.append(pygame.transform.flip(img, True, False))
+# How many chunks wide a generated world is
+GENERATED_WORLD_CHUNKS = 200
 
 
 class Display:
     WHITE = (255, 255, 255)
+    # Things in lower layers are drawn first, like in TextureDisplay
+    SHAPE_LAYER = 1
+    SPRITE_LAYER = 2
+    OVERLAY_LAYER = 3
+    # How far past each edge of the camera the background is drawn, in game
+    # pixels, so the camera can scroll that far before it is drawn again
+    BACKGROUND_MARGIN = 400
    
-    def __init__(self):
+    def __init__(self, dirty_rects=False, scale: float = 1, fullscreen=False):
+        # The size of the part of the world we show, in game pixels
         self.width = 1200
         self.height = 800
-        self.surface = pygame.display.set_mode((self.width, self.height), 0, 32)
+        if fullscreen:
+            self.window = pygame.display.set_mode((0, 0), pygame.FULLSCREEN, 32)
+        else:
+            self.window = pygame.display.set_mode((self.width, self.height), 0, 32)
         pygame.display.set_caption("Robot!")
+        # Everything is drawn onto surface. With a scale below 1 that is a
+        # smaller image than the window, which is much less work to draw on
+        # slow computers, and it gets stretched to fill the window once per
+        # frame. Game positions don't change, only where things are drawn.
+        self.scale = scale
+        size = (int(self.width * scale), int(self.height * scale))
+        if size == self.window.get_size():
+            self.surface = self.window
+        else:
+            self.surface = pygame.Surface(size).convert()
+        # Where the stretched image goes in the window. It keeps the game's
+        # shape, with bars at the sides if the window is a different shape.
+        self.present_rect = self.surface.get_rect().fit(self.window.get_rect())
+        # Maps each image to a copy resized by scale
+        self.scaled_images = {}
+        self.camera = Camera(self.width, self.height)
+        # The blocks in a level don't move, so we draw the ones around the
+        # camera once into a background image a bit bigger than the screen,
+        # and copy the part the camera can see to the screen each frame. It
+        # is only drawn again when the level changes or the camera scrolls
+        # off the edge of it.
+        self.background = None
+        self.background_version = None
+        # The part of the world the background shows, in game pixels
+        self.background_area = None
+        # Where the camera's view starts in the background, in surface pixels
+        self.background_offset = (0, 0)
+        self.background_view = None
+        # In dirty rect mode we only erase and update the areas where moving
+        # things were drawn. These map each moving thing to where it was drawn
+        # this frame and last frame.
+        self.dirty_rects = dirty_rects
+        self.drawn_rects = {}
+        self.last_drawn_rects = {}
+        self.full_update = True
+        # Everything drawn on top of the background is queued up during the
+        # frame and drawn with one Surface.blits call in render(), instead of
+        # one Python call per thing. Colored rects are drawn by blitting a
+        # plain image of that color and size, made once and kept here.
+        self.queue = []
+        self.color_surfaces = {}
+
+    def use_sprites(self, atlas: sprites.SpriteAtlas):
+        """Resizes every frame in atlas to the display's scale up front, so
+        nothing has to be resized while the game is running."""
+        scaled = atlas.scaled(self.scale)
+        for name, frames in atlas.animations.items():
+            for frame, scaled_frame in zip(frames, scaled.frames(name)):
+                self.scaled_images[frame] = scaled_frame
+
+    def scaled(self, image: pygame.Surface) -> pygame.Surface:
+        if self.scale == 1:
+            return image
+        scaled_image = self.scaled_images.get(image)
+        if scaled_image is None:
+            scaled_image = sprites.scale_image(image, self.scale)
+            self.scaled_images[image] = scaled_image
+        return scaled_image
+
+    def to_surface(self, rect: pygame.Rect) -> pygame.Rect:
+        """Turns a rect in game pixels into where it is drawn on surface."""
+        return scale_rect(rect, self.scale)
 
     def clear(self):
         self.surface.fill(self.WHITE)
 
+    def draw_background(self, level):
+        """Draws the level, only redrawing its blocks when the level changed
+        or the camera scrolled past the edge of the background."""
+        view = self.camera.rect
+        if (self.background is None or self.background_version != level.version
+                or not self.background_area.contains(view)):
+            self.redraw_background(level, view)
+        if self.background_view != view:
+            # Everything on the screen moves when the camera does
+            self.background_view = view.copy()
+            self.full_update = True
+            area = self.background_area
+            self.background_offset = (math.floor((view.x - area.x) * self.scale),
+                                      math.floor((view.y - area.y) * self.scale))
+        if self.dirty_rects and not self.full_update:
+            # Erase the moving things by copying the background over them
+            for rect in self.last_drawn_rects.values():
+                self.surface.blit(self.background, rect, rect.move(self.background_offset))
+        else:
+            self.surface.blit(self.background, (0, 0),
+                              pygame.Rect(self.background_offset, self.surface.get_size()))
+
+    def redraw_background(self, level, view: pygame.Rect):
+        margin = self.BACKGROUND_MARGIN
+        # There is nothing to draw past the edges of the world
+        area = view.inflate(2 * margin, 2 * margin).clip(self.camera.world.union(view))
+        size = (math.ceil(area.width * self.scale), math.ceil(area.height * self.scale))
+        if self.background is None or self.background.get_size() != size:
+            self.background = pygame.Surface(size).convert()
+        self.background.fill(self.WHITE)
+        for block in level.index.query(area, dynamic=False):
+            block.draw(self.background, area.x, area.y, self.scale)
+        self.background_version = level.version
+        self.background_area = area
+        # Make draw_background work out the offset again and redraw the screen
+        self.background_view = None
+
+    def is_visible(self, rect: pygame.Rect) -> bool:
+        """Returns whether any of rect (in game pixels, relative to the camera)
+        would show up on the screen."""
+        return self.to_surface(rect).colliderect(self.surface.get_rect())
+
+    def submit(self, layer: int, image: pygame.Surface, rect: pygame.Rect):
+        # Frames from the sprite atlas all have the atlas as their parent, so
+        # sorting by it keeps blits from the same image together.
+        source = image.get_parent() or image
+        self.queue.append((layer, id(source), len(self.queue), image, rect.topleft))
+
+    def color_surface(self, color, size) -> pygame.Surface:
+        surface = self.color_surfaces.get((color, size))
+        if surface is None:
+            surface = pygame.Surface(size).convert()
+            surface.fill(color)
+            self.color_surfaces[(color, size)] = surface
+        return surface
+
+    def fill_rect(self, color, rect: pygame.Rect) -> pygame.Rect:
+        """Fills rect (in game pixels, relative to the camera) with color.
+        Returns the area of surface that will be drawn on."""
+        screen_rect = self.to_surface(rect)
+        self.submit(self.SHAPE_LAYER, self.color_surface(color, screen_rect.size), screen_rect)
+        return screen_rect
+
+    def draw_image(self, image: pygame.Surface, rect: pygame.Rect) -> pygame.Rect:
+        """Draws image at rect (in game pixels, relative to the camera).
+        Returns the area of surface that will be drawn on."""
+        screen_rect = self.to_surface(rect)
+        image = self.scaled(image)
+        self.submit(self.SPRITE_LAYER, image, screen_rect)
+        return screen_rect.union((screen_rect.topleft, image.get_size()))
+
+    def draw_overlay(self, timer: FrameTimer):
+        overlay = timer.overlay_image()
+        if overlay is not None:
+            self.submit(self.OVERLAY_LAYER, overlay, overlay.get_rect())
+            self.mark_dirty(timer, overlay.get_rect().clip(self.surface.get_rect()))
+
+    def draw_queue(self):
+        """Draws everything queued this frame, in layers and grouped by image."""
+        self.queue.sort(key=lambda draw: draw[:3])
+        self.surface.blits([draw[3:] for draw in self.queue], doreturn=False)
+        self.queue = []
+
+    def mark_dirty(self, item, rect: pygame.Rect):
+        """Moving things call this with the area they drew on this frame."""
+        self.drawn_rects[item] = rect
+
+    def present(self):
+        """Stretches surface to fill the window, if they aren't the same."""
+        if self.surface is self.window:
+            return
+        if self.full_update:
+            self.window.fill((0, 0, 0))
+        pygame.transform.scale(self.surface, self.present_rect.size,
+                               self.window.subsurface(self.present_rect))
+
+    def to_window(self, rect: pygame.Rect) -> pygame.Rect:
+        """Turns a rect on surface into the area of the window it was stretched to."""
+        if self.surface is self.window:
+            return rect
+        scale_x = self.present_rect.width / self.surface.get_width()
+        scale_y = self.present_rect.height / self.surface.get_height()
+        # One pixel extra on each side covers any rounding when stretching
+        left = self.present_rect.x + math.floor(rect.left * scale_x) - 1
+        top = self.present_rect.y + math.floor(rect.top * scale_y) - 1
+        right = self.present_rect.x + math.ceil(rect.right * scale_x) + 1
+        bottom = self.present_rect.y + math.ceil(rect.bottom * scale_y) + 1
+        return pygame.Rect(left, top, right - left, bottom - top)
+
     def render(self):
-        pygame.display.update()
+        self.draw_queue()
+        self.present()
+        if self.dirty_rects and not self.full_update:
+            # Each moving thing needs both its old and new area sent to the
+            # screen: the old one to erase it and the new one to show it.
+            rects = []
+            for item, rect in self.drawn_rects.items():
+                last_rect = self.last_drawn_rects.pop(item, None)
+                if last_rect is None:
+                    rects.append(self.to_window(rect))
+                else:
+                    rects.append(self.to_window(rect.union(last_rect)))
+            # Anything left was drawn last frame but not this one
+            rects.extend(self.to_window(rect) for rect in self.last_drawn_rects.values())
+            pygame.display.update(rects)
+        else:
+            pygame.display.update()
+        self.last_drawn_rects = self.drawn_rects
+        self.drawn_rects = {}
+        self.full_update = False
+
 
+def scale_rect(rect: pygame.Rect, scale: float) -> pygame.Rect:
+    """Resizes rect and its position by scale. Each edge is rounded down on
+    its own, so blocks that touch still touch after scaling."""
+    if scale == 1:
+        return rect
+    left = math.floor(rect.left * scale)
+    top = math.floor(rect.top * scale)
+    right = math.floor(rect.right * scale)
+    bottom = math.floor(rect.bottom * scale)
+    return pygame.Rect(left, top, right - left, bottom - top)
 
-# A Block can be used to build ground, walls, and platforms
+
+# A Block can be used to build ground, walls, and platforms.
+# __slots__ tells Python exactly which attributes a Block has, so each one
+# takes less memory. The position and size live only in the rect.
 class Block:
+    __slots__ = ("rect", "color")
+
     def __init__(self, x: int, y: int, height: int, width: int, color: (int, int, int)):
-        self.x = x
-        self.y = y - height
-        self.height = height
-        self.width = width
-        self.rect = pygame.Rect(self.x, self.y, self.width, self.height)
+        self.rect = pygame.Rect(x, y - height, width, height)
         self.color = color
 
+    @property
+    def x(self):
+        return self.rect.x
+
+    @property
+    def y(self):
+        return self.rect.y
+
+    @property
+    def width(self):
+        return self.rect.width
+
+    @property
+    def height(self):
+        return self.rect.height
+
+    def draw(self, surface: pygame.Surface, camera_x: int = 0, camera_y: int = 0, scale: float = 1):
+        pygame.draw.rect(surface, self.color, scale_rect(self.rect.move(-camera_x, -camera_y), scale))
+
+    def render(self, display: Display):
+        camera = display.camera
+        display.fill_rect(self.color, self.rect.move(-camera.x, -camera.y))
+
+
+# A MovingBlock moves by itself, like a moving platform or an elevator.
+# Moving blocks are "dynamic" in the level's SpatialHash, so they aren't
+# drawn into the cached background. They are drawn every frame like players.
+class MovingBlock(Block):
+    __slots__ = ("previous_x", "previous_y", "moved_x", "moved_y")
+
+    def __init__(self, x: int, y: int, height: int, width: int, color: (int, int, int)):
+        super().__init__(x, y, height, width, color)
+        self.previous_x = self.rect.x
+        self.previous_y = self.rect.y
+        # How far the block moved in the last step
+        self.moved_x = 0
+        self.moved_y = 0
+
+    def next_position(self, ridden: bool):
+        """Returns where the top left of the block goes next. ridden is
+        whether a player is standing on it."""
+        return self.rect.topleft
+
+    def update(self, ridden: bool = False):
+        self.previous_x = self.rect.x
+        self.previous_y = self.rect.y
+        x, y = self.next_position(ridden)
+        self.moved_x = x - self.rect.x
+        self.moved_y = y - self.rect.y
+        self.rect.topleft = (x, y)
+
+    def carries_riders(self) -> bool:
+        """Should players standing on the block move with it this step?"""
+        return True
+
+    def load_state(self, state):
+        self.rect.topleft = state[:2]
+        self.previous_x = self.rect.x
+        self.previous_y = self.rect.y
+        self.moved_x = 0
+        self.moved_y = 0
+
+    def render(self, display: Display, alpha: float = 1):
+        # Drawn part way between steps, just like players
+        x = round(self.previous_x + (self.rect.x - self.previous_x) * alpha)
+        y = round(self.previous_y + (self.rect.y - self.previous_y) * alpha)
+        camera = display.camera
+        rect = pygame.Rect(x - camera.x, y - camera.y, self.rect.width, self.rect.height)
+        if display.is_visible(rect):
+            display.mark_dirty(self, display.fill_rect(self.color, rect))
+
+
+# A PathBlock goes from point to point along a path, at speed pixels per
+# step, then starts over from the first point. The points are where its top
+# left corner goes. A path of two points makes it go back and forth: sideways
+# for a moving platform, or up and down for an elevator.
+class PathBlock(MovingBlock):
+    __slots__ = ("path", "speed", "target", "step_x", "step_y", "steps_left")
+
+    def __init__(self, x: int, y: int, height: int, width: int, color: (int, int, int),
+                 path, speed: int = 2):
+        super().__init__(x, y, height, width, color)
+        self.path = [tuple(point) for point in path]
+        self.speed = speed
+        # The point in path it is heading for
+        self.target = 0
+        self.head_for(0, self.rect.x, self.rect.y)
+
+    def head_for(self, target: int, x: int, y: int):
+        """Works out how far to move each step to get from (x, y) to
+        path[target], once, instead of every step."""
+        self.target = target
+        target_x, target_y = self.path[target]
+        distance_x = target_x - x
+        distance_y = target_y - y
+        distance = math.hypot(distance_x, distance_y)
+        self.steps_left = int(distance // self.speed)
+        self.step_x = 0
+        self.step_y = 0
+        if self.steps_left > 0:
+            self.step_x = round(distance_x / distance * self.speed)
+            self.step_y = round(distance_y / distance * self.speed)
+
+    def save_state(self):
+        return (self.rect.x, self.rect.y, self.target, self.step_x, self.step_y, self.steps_left)
+
+    def load_state(self, state):
+        super().load_state(state)
+        self.target, self.step_x, self.step_y, self.steps_left = state[2:]
+
+    def next_position(self, ridden: bool):
+        if self.steps_left > 0:
+            self.steps_left = self.steps_left - 1
+            return self.rect.x + self.step_x, self.rect.y + self.step_y
+        # Close enough, so finish at the point and head for the next one
+        x, y = self.path[self.target]
+        self.head_for((self.target + 1) % len(self.path), x, y)
+        return x, y
+
+
+# A FallingBlock starts to fall a moment after someone stands on it. Once it
+# has fallen out of sight it goes back to where it started.
+class FallingBlock(MovingBlock):
+    # Steps between being stood on and falling
+    DELAY = 15
+    GRAVITY = 1
+    MAX_SPEED = 15
+    FALL_DISTANCE = 2000
+
+    __slots__ = ("start", "wait", "speed")
+
+    def __init__(self, x: int, y: int, height: int, width: int, color: (int, int, int)):
+        super().__init__(x, y, height, width, color)
+        self.start = self.rect.topleft
+        # Steps left before it falls, or None if nobody has stood on it yet
+        self.wait = None
+        self.speed = 0
+
+    def next_position(self, ridden: bool):
+        x, y = self.rect.topleft
+        if self.wait is None:
+            if ridden:
+                self.wait = self.DELAY
+            return x, y
+        if self.wait > 0:
+            self.wait = self.wait - 1
+            return x, y
+        if y - self.start[1] >= self.FALL_DISTANCE:
+            self.wait = None
+            self.speed = 0
+            return self.start
+        self.speed = min(self.speed + self.GRAVITY, self.MAX_SPEED)
+        return x, y + self.speed
+
+    def save_state(self):
+        return (self.rect.x, self.rect.y, -1 if self.wait is None else self.wait, self.speed)
+
+    def load_state(self, state):
+        super().load_state(state)
+        self.wait = None if state[2] == -1 else state[2]
+        self.speed = state[3]
+
+    def carries_riders(self) -> bool:
+        # Not when it jumps back to the start
+        return self.wait is not None
+
+    def update(self, ridden: bool = False):
+        super().update(ridden)
+        if self.wait is None and self.moved_y < 0:
+            # Went back to the start, so don't draw it sliding back up
+            self.previous_x, self.previous_y = self.rect.topleft
+
+
+# A SpatialHash splits the world into square cells and remembers which cells
+# each block touches. When a player asks "what could I be hitting?", we only
+# look in the cells around the player instead of checking every block in
+# the level. Anything with a .rect can go in: blocks, tiles and players.
+class SpatialHash:
+    CELL_SIZE = 100
+
+    def __init__(self, cell_size: int = CELL_SIZE):
+        self.cell_size = cell_size
+        # Maps (column, row) to the list of items in that cell
+        self.cells = {}
+        # Maps each item to the cells it is currently in
+        self.item_cells = {}
+        # Queries return items in the order they were added, with dynamic
+        # items (like moving blocks) first, just like the old per-player rect lists.
+        self.item_order = {}
+        self.next_order = 0
+
+    def cell_span(self, rect: pygame.Rect):
+        """Returns the first and last (column, row) of the cells rect touches."""
+        size = self.cell_size
+        left = rect.left // size
+        right = (rect.right - 1) // size if rect.width > 0 else left
+        top = rect.top // size
+        bottom = (rect.bottom - 1) // size if rect.height > 0 else top
+        return (left, top), (right, bottom)
+
+    def cell_keys(self, rect: pygame.Rect):
+        (left, top), (right, bottom) = self.cell_span(rect)
+        return [(column, row)
+                for column in range(left, right + 1)
+                for row in range(top, bottom + 1)]
+
+    def add(self, item, dynamic=False):
+        self.item_order[item] = (0 if dynamic else 1, self.next_order)
+        self.next_order = self.next_order + 1
+        self.insert(item)
+
+    def remove(self, item):
+        for key in self.item_cells.pop(item):
+            cell = self.cells[key]
+            cell.remove(item)
+            if len(cell) == 0:
+                del self.cells[key]
+        del self.item_order[item]
+
+    def __contains__(self, item):
+        return item in self.item_order
+
+    def move(self, item):
+        """Call this after an item's rect changes so it lands in the right cells."""
+        # Keys go from the top left cell to the bottom right one, so only
+        # those two need comparing to see if the item is still in the same cells
+        keys = self.item_cells[item]
+        first, last = self.cell_span(item.rect)
+        if first == keys[0] and last == keys[-1]:
+            return
+        for key in self.item_cells.pop(item):
+            cell = self.cells[key]
+            cell.remove(item)
+            if len(cell) == 0:
+                del self.cells[key]
+        self.insert(item)
+
+    def insert(self, item):
+        keys = self.cell_keys(item.rect)
+        self.item_cells[item] = keys
+        for key in keys:
+            self.cells.setdefault(key, []).append(item)
+
+    def query(self, rect: pygame.Rect, ignore=None, dynamic=True) -> list:
+        """Returns every item in the cells that rect touches, except ignore.
+        Pass dynamic=False to leave out the dynamic items."""
+        found = set()
+        cells = self.cells
+        for key in self.cell_keys(rect):
+            cell = cells.get(key)
+            if cell is not None:
+                found.update(cell)
+        found.discard(ignore)
+        order = self.item_order
+        if not dynamic:
+            return sorted((item for item in found if order[item][0] == 1), key=order.__getitem__)
+        return sorted(found, key=order.__getitem__)
+
+
+# A PlayerSweep finds which players could be touching, using "sort and
+# sweep": the players are kept sorted by the left edge of their rects, so the
+# ones near a given x are all next to each other in the list and we can find
+# them with a binary search instead of checking every player.
+class PlayerSweep:
+    def __init__(self):
+        self.sorted = []
+        self.lefts = []
+        # Queries return players in the order they were added, like SpatialHash
+        self.order = {}
+        self.max_width = 0
+
+    def add(self, player):
+        self.order[player] = len(self.order)
+        self.sorted.append(player)
+        self.update()
+
+    def remove(self, player):
+        self.sorted.remove(player)
+        del self.order[player]
+        self.update()
+
+    def update(self):
+        """Call this after the players' rects move. Players only move a little
+        each step, so the list is nearly sorted already and sorting it again
+        takes about one pass."""
+        self.sorted.sort(key=lambda player: player.rect.left)
+        self.lefts = [player.rect.left for player in self.sorted]
+        self.max_width = max([player.rect.width for player in self.sorted], default=0)
+
+    def query(self, rect: pygame.Rect, ignore=None) -> list:
+        """Returns the players whose rects are level with rect along x, except ignore."""
+        # A player can only reach into rect if its left edge is less than one
+        # player width to the left of rect.
+        start = bisect.bisect_left(self.lefts, rect.left - self.max_width + 1)
+        end = bisect.bisect_left(self.lefts, rect.right)
+        found = [player for player in self.sorted[start:end] if player is not ignore]
+        if len(found) > 1:
+            found.sort(key=self.order.__getitem__)
+        return found
+
+
+# Everything a player can bump into: the blocks in the level's SpatialHash,
+# shared by every player, and the other players.
+class CollisionIndex:
+    def __init__(self, blocks: SpatialHash, players: PlayerSweep):
+        self.blocks = blocks
+        self.players = players
+
+    def query(self, rect: pygame.Rect, ignore=None) -> list:
+        """Returns the players, then the blocks, that rect could be touching."""
+        players = self.players.query(rect, ignore)
+        blocks = self.blocks.query(rect, ignore)
+        if len(players) == 0:
+            return blocks
+        return players + blocks
+
+
+# A Level holds all of the blocks that make up the world. We build it once
+# when the game starts instead of building new blocks every frame. Whenever
+# blocks are added or removed, the level's version goes up so anything that
+# remembers the blocks (like a drawing cache) knows it needs to catch up.
+# The level also keeps a SpatialHash of its blocks for collision checks.
+class Level:
+    def __init__(self, blocks=None):
+        self.blocks = []
+        # The blocks that move by themselves. They are in blocks too.
+        self.moving = []
+        self.version = 0
+        self.index = SpatialHash()
+        if blocks is not None:
+            for block in blocks:
+                self.add(block)
+
+    def add(self, block):
+        self.blocks.append(block)
+        self.index_block(block)
+        self.mark_dirty()
+
+    def remove(self, block):
+        self.blocks.remove(block)
+        self.unindex_block(block)
+        self.mark_dirty()
+
+    def add_blocks(self, blocks):
+        """Adds lots of blocks at once, like a chunk of a streamed world."""
+        for block in blocks:
+            self.blocks.append(block)
+            self.index_block(block)
+        self.mark_dirty()
+
+    def remove_blocks(self, blocks):
+        removing = set(blocks)
+        for block in removing:
+            self.unindex_block(block)
+        self.blocks = [block for block in self.blocks if block not in removing]
+        self.mark_dirty()
+
+    def replace_blocks(self, blocks):
+        """Swaps every block in the level for a new set of blocks."""
+        for block in self.blocks:
+            self.unindex_block(block)
+        self.blocks = []
+        for block in blocks:
+            self.blocks.append(block)
+            self.index_block(block)
+        self.mark_dirty()
+
+    def index_block(self, block):
+        if isinstance(block, MovingBlock):
+            self.moving.append(block)
+            self.index.add(block, dynamic=True)
+        else:
+            self.index.add(block)
+
+    def unindex_block(self, block):
+        self.index.remove(block)
+        if isinstance(block, MovingBlock):
+            self.moving.remove(block)
+
+    def update(self, ridden=()):
+        """Moves each moving block one step. ridden is the blocks players are
+        standing on. Only the blocks that moved are moved in the index, and
+        the version doesn't change because the background doesn't show them."""
+        for block in self.moving:
+            block.update(block in ridden)
+            if block.moved_x != 0 or block.moved_y != 0:
+                self.index.move(block)
+
+    def mark_dirty(self, block=None):
+        """Call this after changing a block in place so caches get rebuilt."""
+        if block is not None:
+            self.index.move(block)
+        self.version = self.version + 1
+
     def render(self, display: Display):
-        pygame.draw.rect(display.surface, self.color, self.rect)
+        for block in self.blocks:
+            block.render(display)
+
+    def render_moving(self, display: Display, alpha: float = 1):
+        for block in self.moving:
+            block.render(display, alpha)
 
 
 class Player:
@@ -79,19 +722,53 @@ class Player:
     MAX_FORCE = 20
     # How fast the player moves in each frame
     VELOCITY = 8
+    # How much narrower than the image the player's collide rect and feet are
+    COLLIDE_INSET = 26
+    FEET_INSET = 54
+    # How far below the top of the image the collide rect starts
+    COLLIDE_TOP = 35
+    # How heavy a jump is: the force is JUMP_MASS times jumping_velocity
+    JUMP_MASS = 2
+
+    __slots__ = ("display", "player_img", "move_left_key", "move_right_key", "jump_key",
+                 "player_width", "feet_width", "player_height", "x", "y",
+                 "previous_x", "previous_y", "velocity", "last_move", "last_move_repeat_count",
+                 "is_jumping", "is_falling", "jumping_velocity", "jumping_mass", "rect",
+                 "bounds", "collide_bounds", "feet_bounds", "pixel_collisions", "mask",
+                 "ground", "asleep")
 
-    def __init__(self, display: Display, move_left_key, move_right_key, jump_key):
+    def __init__(self, display: Display, move_left_key, move_right_key, jump_key,
+                 pixel_collisions=False):
         self.display = display
+        if PLAYER_IDLE_IMG is None:
+            load_sprites()
         self.player_img = PLAYER_IDLE_IMG
+        # With pixel collisions, players bump into each other where the
+        # pixels of their images touch, instead of using the collide rect.
+        self.pixel_collisions = pixel_collisions
+        self.mask = None
         self.move_left_key = move_left_key
         self.move_right_key = move_right_key
         self.jump_key = jump_key
         img_rect = self.player_img.get_rect()
         self.player_width = img_rect.width
-        self.feet_width = self.player_width - 54
+        self.feet_width = self.player_width - self.FEET_INSET
         self.player_height = img_rect.height
         self.x = 10
         self.y = 10
+        # These rects are made once and moved to the player's position each
+        # time they are asked for, instead of making new rects every frame.
+        self.bounds = pygame.Rect(0, 0, 0, 0)
+        self.collide_bounds = pygame.Rect(0, 0, 0, 0)
+        self.feet_bounds = pygame.Rect(0, 0, 0, 0)
+        # The rect other players bump into (and with pixel collisions, the
+        # mask). They are updated once per frame by refresh_rect.
+        self.rect = pygame.Rect(0, 0, 0, 0)
+        self.refresh_rect()
+        # Where the player was before the last physics step. When drawing
+        # between two physics steps we draw the player part way between.
+        self.previous_x = self.x
+        self.previous_y = self.y
         self.velocity = self.VELOCITY
         # The last move the user
         self.last_move = self.IDLE
@@ -102,7 +779,13 @@ class Player:
         self.is_jumping = False
         self.is_falling = False
         self.jumping_velocity = JUMP_START_VELOCITY
-        self.jumping_mass = 2
+        self.jumping_mass = self.JUMP_MASS
+        # The block the player was last standing on. While the player's feet
+        # still touch it, we don't need to look for ground anywhere else.
+        self.ground = None
+        # A player standing still is put to sleep by the game and skips its
+        # physics until a key is pressed or the ground under it changes.
+        self.asleep = False
 
     def change_last_move(self, last_move):
         if self.last_move == last_move:
@@ -111,12 +794,12 @@ class Player:
             self.last_move = last_move
             self.last_move_repeat_count = 0
 
-    def move_right(self, rects):
-        self.set_x(self.x + self.velocity, rects)
+    def move_right(self, index: CollisionIndex):
+        self.set_x(self.x + self.velocity, index)
         self.change_last_move(self.MOVE_RIGHT)
 
-    def move_left(self, rects):
-        self.set_x(self.x - self.velocity, rects)
+    def move_left(self, index: CollisionIndex):
+        self.set_x(self.x - self.velocity, index)
         self.change_last_move(self.MOVE_LEFT)
 
     def jump(self):
@@ -126,36 +809,113 @@ class Player:
     def walking_img_index(self):
         return int(self.last_move_repeat_count // 2) % 8
 
+    # The rect helpers below always return the same rect object, moved to
+    # where the player is now. Copy it if you need to keep it.
     def player_rect(self) -> pygame.Rect:
-        return pygame.Rect(self.x, self.y, self.player_width, self.player_height)
+        self.bounds.update(self.x, self.y, self.player_width, self.player_height)
+        return self.bounds
 
     def player_collide_rect(self) -> pygame.Rect:
-        width = self.player_width - 26
+        width = self.player_width - self.COLLIDE_INSET
         edge_buffer = (self.player_width - width)/2
-        top_buffer = 35
+        top_buffer = self.COLLIDE_TOP
         height = self.player_height - top_buffer
-        return pygame.Rect(self.x + edge_buffer, self.y + top_buffer, width, height)
-    
+        self.collide_bounds.update(self.x + edge_buffer, self.y + top_buffer, width, height)
+        return self.collide_bounds
+
     def feet_rect(self) -> pygame.Rect:
         edge_buffer = (self.player_width - self.feet_width) / 2
-        return pygame.Rect(self.x + edge_buffer, self.y + self.player_height, self.feet_width, 1)
+        self.feet_bounds.update(self.x + edge_buffer, self.y + self.player_height, self.feet_width, 1)
+        return self.feet_bounds
+
+    def refresh_rect(self):
+        """Moves the rect other players bump into to where this player is now."""
+        if self.pixel_collisions:
+            self.rect.update(self.player_rect())
+            self.mask = image_mask(self.player_img)
+        else:
+            self.rect.update(self.player_collide_rect())
+
+    def candidates(self, rect: pygame.Rect, index: CollisionIndex) -> list:
+        """Returns what rect could be hitting. Other players are left out with
+        pixel collisions, because they are checked by pixel_overlaps instead."""
+        if self.pixel_collisions:
+            return index.blocks.query(rect, self)
+        return index.query(rect, self)
+
+    def pixel_overlaps(self, index: CollisionIndex) -> dict:
+        """Returns how many pixels of this player overlap each player it
+        touches. Masks are only compared for players whose rects overlap ours,
+        so players that are apart cost no more than a rect check."""
+        rect = self.player_rect()
+        overlaps = {}
+        mask = None
+        for other in index.players.query(rect, self):
+            if not rect.colliderect(other.rect):
+                continue
+            if mask is None:
+                mask = image_mask(self.player_img)
+            area = mask.overlap_area(other.mask, (other.rect.x - rect.x, other.rect.y - rect.y))
+            if area > 0:
+                overlaps[other] = area
+        return overlaps
+
+    def pushed_into(self, index: CollisionIndex, before: dict) -> bool:
+        """Does this player overlap any player more than it did before? Players
+        that were already overlapping are allowed to move apart."""
+        for other, area in self.pixel_overlaps(index).items():
+            if area > before.get(other, 0):
+                return True
+        return False
 
-    def set_y(self, y, rects):
+    def back_off(self, index: CollisionIndex, axis: str, target: int, before: dict) -> bool:
+        """Moves the player one pixel at a time along axis ("x" or "y") back
+        towards target until it stops pushing into other players. Returns True
+        if it had to move."""
+        position = getattr(self, axis)
+        step = 1 if target > position else -1
+        moved = False
+        while position != target and self.pushed_into(index, before):
+            position = position + step
+            setattr(self, axis, position)
+            moved = True
+        return moved
+
+    def set_y(self, y, index: CollisionIndex):
         """Sets y ensuring that no collisions exist after the setting."""
+        previous_y = self.y
+        if self.pixel_collisions:
+            before = self.pixel_overlaps(index)
         self.y = y
-        collide_idx = self.feet_rect().collidelist(rects)
-        if collide_idx is not -1:
+        feet_rect = self.feet_rect()
+        rects = self.candidates(feet_rect, index)
+        collide_idx = feet_rect.collidelist(rects)
+        if collide_idx != -1:
             self.y = rects[collide_idx].rect.top - self.player_height
             self.is_jumping = False
             self.is_falling = False
+            self.remember_ground(rects[collide_idx], index)
         else:
             self.is_falling = True
+        if self.pixel_collisions and self.back_off(index, "y", previous_y, before):
+            self.ground = None
+            if self.y < y:
+                # Came down on top of another player
+                self.is_jumping = False
+                self.is_falling = False
+            else:
+                # Bumped our head on another player
+                self.jumping_velocity = 0
 
-    def set_x(self, x, rects):
+    def set_x(self, x, index: CollisionIndex):
         """Sets x ensuring no collisions exist after setting"""
+        previous_x = self.x
+        if self.pixel_collisions:
+            before = self.pixel_overlaps(index)
         self.x = x
         player_collide_rect = self.player_collide_rect()
         player_rect = self.player_rect()
+        rects = self.candidates(player_collide_rect, index)
         collisions = player_collide_rect.collidelistall(rects)
         max_right = player_collide_rect.right
         min_left = player_collide_rect.left
@@ -191,9 +951,20 @@ class Player:
         elif min_left > player_collide_rect.left:
             left_buffer = player_collide_rect.left - player_rect.left
             self.x = min_left - left_buffer
+        if self.pixel_collisions:
+            self.back_off(index, "x", previous_x, before)
             
+    def keep_inside(self, world: pygame.Rect):
+        """Moves the player back into the world if other players squeezed it
+        out through one of the edge walls."""
+        collide_rect = self.player_collide_rect()
+        if collide_rect.left < world.left:
+            self.x = self.x + world.left - collide_rect.left
+        elif collide_rect.right > world.right:
+            self.x = self.x - (collide_rect.right - world.right)
+
     # Update to be called during each frame
-    def update(self, pressed_keys, rects):
+    def update(self, pressed_keys, index: CollisionIndex):
         movements = []
         if pressed_keys[self.move_right_key]:
             movements.append(self.MOVE_RIGHT)
@@ -209,9 +980,9 @@ class Player:
             self.change_last_move(self.IDLE)
         for movement in movements:
             if movement == self.MOVE_RIGHT:
-                self.move_right(rects)
+                self.move_right(index)
             elif movement == self.MOVE_LEFT:
-                self.move_left(rects)
+                self.move_left(index)
             elif movement == self.JUMP and not self.is_falling and not self.is_jumping:
                 self.jump()
 
@@ -220,7 +991,7 @@ class Player:
             force = self.jumping_mass * self.jumping_velocity
             if force + self.MAX_FORCE < 0:
                 force = -self.MAX_FORCE
-            self.set_y(self.y - force, rects)
+            self.set_y(self.y - force, index)
             # jumping_velocity starts positive and will end negative
             self.jumping_velocity = self.jumping_velocity - 1
             if self.last_move == self.MOVE_LEFT:
@@ -229,6 +1000,7 @@ class Player:
                 self.player_img = PLAYER_JUMP_RIGHT
             if force > 0: # going up
                 player_rect = self.player_collide_rect()
+                rects = self.candidates(player_rect, index)
                 collisions = player_rect.collidelistall(rects)
                 has_top_collision = False
                 for idx in collisions:
@@ -254,21 +1026,193 @@ class Player:
                 self.player_img = PLAYER_WALKING_LEFT[self.walking_img_index()]
             else:
                 self.player_img = PLAYER_WALKING_RIGHT[self.walking_img_index()]
-            collide_idx = self.feet_rect().collidelist(rects)
-            if collide_idx == -1:
+            if not self.on_ground(index) and not self.standing_on_player(index):
                 # Player is falling since there is no ground below
-                self.set_y(self.y + self.GRAVITY, rects)
+                self.set_y(self.y + self.GRAVITY, index)
 
-    def render(self):
-        pygame.draw.rect(self.display.surface, YELLOW, self.player_collide_rect())
-        self.display.surface.blit(self.player_img, (self.x, self.y))
+    def remember_ground(self, item, index: CollisionIndex):
+        # Only blocks are remembered. Other players move every step.
+        self.ground = item if item in index.blocks else None
+
+    def on_ground(self, index: CollisionIndex) -> bool:
+        """Is something right under the player's feet? The block we stood on
+        last time is checked first, so standing or walking along one block
+        doesn't look through the collision index every step."""
+        feet_rect = self.feet_rect()
+        ground = self.ground
+        if ground is not None and feet_rect.colliderect(ground.rect) and ground in index.blocks:
+            return True
+        rects = self.candidates(feet_rect, index)
+        collide_idx = feet_rect.collidelist(rects)
+        if collide_idx == -1:
+            self.ground = None
+            return False
+        self.remember_ground(rects[collide_idx], index)
+        return True
+
+    def riding(self) -> bool:
+        """Is the player standing on a moving block?"""
+        return (isinstance(self.ground, MovingBlock) and not self.is_jumping
+                and self.feet_rect().colliderect(self.ground.rect))
+
+    def ride(self, index: CollisionIndex):
+        """Moves the player along with the moving block it is standing on,
+        stopping at walls like it would when walking."""
+        block = self.ground
+        if block.moved_y != 0 and not self.carry_y(block.moved_y, index):
+            # Something solid got in the way, so the player gets off
+            self.ground = None
+            return
+        if block.moved_x != 0:
+            self.set_x(self.x + block.moved_x, index)
+
+    def carry_y(self, distance: int, index: CollisionIndex) -> bool:
+        """Moves the player distance pixels down (or up, if it is negative)
+        with the block under it. Only the level's static blocks can stop it,
+        since the block it is riding would always be in the way. Returns False
+        if it was stopped by a floor or a ceiling."""
+        if distance > 0:
+            # Everything the feet pass through on the way down
+            feet_rect = self.feet_rect()
+            path = pygame.Rect(feet_rect.x, feet_rect.y, feet_rect.width, distance + 1)
+        else:
+            # Everything the head passes through on the way up
+            collide_rect = self.player_collide_rect()
+            path = pygame.Rect(collide_rect.x, collide_rect.y + distance, collide_rect.width,
+                               -distance)
+        blocks = index.blocks.query(path, dynamic=False)
+        hits = [blocks[i].rect for i in path.collidelistall(blocks)]
+        if len(hits) == 0:
+            self.y = self.y + distance
+            return True
+        if distance > 0:
+            # Land on the highest floor instead
+            self.y = min(rect.top for rect in hits) - self.player_height
+            self.is_falling = False
+        else:
+            # Stay under the lowest ceiling and let the block go on without us
+            self.y = max(rect.bottom for rect in hits) - self.COLLIDE_TOP
+        return False
+
+    def wants_to_move(self, pressed_keys) -> bool:
+        return (pressed_keys[self.move_left_key] or pressed_keys[self.move_right_key]
+                or pressed_keys[self.jump_key])
+
+    def settled(self) -> bool:
+        """Can the player go to sleep? It has to be standing still on a block,
+        and its rect (and mask) must already be where they will stay."""
+        if self.is_jumping or self.is_falling or self.last_move != self.IDLE or self.ground is None:
+            return False
+        if self.x != self.previous_x or self.y != self.previous_y:
+            return False
+        # A player that just landed still shows its jump image for one step
+        if self.player_img is not PLAYER_IDLE_IMG:
+            return False
+        return not self.pixel_collisions or self.mask is image_mask(self.player_img)
+
+    def rest(self):
+        """What update does for a sleeping player: nothing moves, but it has
+        still been idle for one more step."""
+        self.change_last_move(self.IDLE)
+
+    def standing_on_player(self, index: CollisionIndex) -> bool:
+        """With pixel collisions, is there another player right under our pixels?"""
+        if not self.pixel_collisions:
+            return False
+        before = self.pixel_overlaps(index)
+        self.y = self.y + 1
+        below = self.pushed_into(index, before)
+        self.y = self.y - 1
+        return below
+
+    def save_position(self):
+        self.previous_x = self.x
+        self.previous_y = self.y
+
+    def save_state(self):
+        """Everything about the player that changes as it plays, as whole
+        numbers, for rewinding."""
+        return (self.x, self.y, self.jumping_velocity, self.is_jumping, self.is_falling,
+                self.last_move, self.last_move_repeat_count, PLAYER_FRAME_NUMBERS[self.player_img])
+
+    def load_state(self, state):
+        (self.x, self.y, self.jumping_velocity, is_jumping, is_falling,
+         self.last_move, self.last_move_repeat_count, frame) = state
+        self.is_jumping = bool(is_jumping)
+        self.is_falling = bool(is_falling)
+        self.player_img = PLAYER_FRAMES[frame]
+        self.save_position()
+        # Anything worked out from the old position has to be worked out again
+        self.ground = None
+        self.asleep = False
+
+    def drawn_position(self, alpha: float = 1):
+        """Returns where the player is drawn: alpha of the way from its
+        previous position to its current one, where alpha is between 0 and 1."""
+        x = round(self.previous_x + (self.x - self.previous_x) * alpha)
+        y = round(self.previous_y + (self.y - self.previous_y) * alpha)
+        return x, y
+
+    def render(self, alpha: float = 1):
+        x, y = self.drawn_position(alpha)
+        # Where the player shows up in the window
+        camera = self.display.camera
+        x = x - camera.x
+        y = y - camera.y
+        display = self.display
+        screen_rect = pygame.Rect(x, y, self.player_width, self.player_height)
+        if not display.is_visible(screen_rect):
+            return
+        display.fill_rect(YELLOW, self.player_collide_rect().move(x - self.x, y - self.y))
+        display.mark_dirty(self, display.draw_image(self.player_img, screen_rect))
         #pygame.draw.rect(display.surface, RED, self.feet_rect())
 
 
-display = Display()
-player1 = Player(display, pygame.K_a, pygame.K_d, pygame.K_w)
-player2 = Player(display, pygame.K_k, pygame.K_SEMICOLON, pygame.K_o)
-player2.x = display.width - player2.player_width
+def load_sprites():
+    """When rendering the player, we use images saved in our assets directory.
+    They are packed into one sprite atlas in the display's pixel format, so
+    they have to be loaded after the display is created."""
+    global ROBOT_SPRITES, PLAYER_IDLE_IMG, PLAYER_JUMP_RIGHT, PLAYER_JUMP_LEFT
+    global PLAYER_WALKING_RIGHT, PLAYER_WALKING_LEFT
+    ROBOT_SPRITES = sprites.load_robot_atlas()
+    PLAYER_IDLE_IMG = ROBOT_SPRITES.frame("idle")
+    PLAYER_JUMP_RIGHT = ROBOT_SPRITES.frame("jump_right")
+    PLAYER_JUMP_LEFT = ROBOT_SPRITES.frame("jump_left")
+    PLAYER_WALKING_RIGHT = ROBOT_SPRITES.frames("walk_right")
+    PLAYER_WALKING_LEFT = ROBOT_SPRITES.frames("walk_left")
+    # Make the masks for pixel collisions now so it doesn't happen mid-game.
+    # Each frame also gets a number so saved games can say which one was showing.
+    PLAYER_MASKS.clear()
+    PLAYER_FRAMES.clear()
+    PLAYER_FRAME_NUMBERS.clear()
+    for frames in ROBOT_SPRITES.animations.values():
+        for frame in frames:
+            image_mask(frame)
+            PLAYER_FRAME_NUMBERS[frame] = len(PLAYER_FRAMES)
+            PLAYER_FRAMES.append(frame)
+
+
+def image_mask(image: pygame.Surface) -> pygame.mask.Mask:
+    """Returns which pixels of image can be touched. Each image's mask is only
+    made once."""
+    mask = PLAYER_MASKS.get(image)
+    if mask is None:
+        mask = pygame.mask.from_surface(image)
+        PLAYER_MASKS[image] = mask
+    return mask
+
+
+# The robot images are None until load_sprites() fills them in, which Game
+# (or the first Player made) does
+ROBOT_SPRITES = None
+PLAYER_IDLE_IMG = None
+PLAYER_JUMP_RIGHT = None
+PLAYER_JUMP_LEFT = None
+PLAYER_WALKING_RIGHT = []
+PLAYER_WALKING_LEFT = []
+PLAYER_MASKS = {}
+PLAYER_FRAMES = []
+PLAYER_FRAME_NUMBERS = {}
 
 
 def generate_blocks(display: Display):
@@ -290,35 +1234,492 @@ def generate_blocks(display: Display):
     return blocks
 
 
-# Main game loop that is executed FPS times per second.
-# Each time through the loop is one frame in the game.
-while True:
-    # Each time we execute a frame, we ask pygame to tell us the state of
-    # all the keyboard keys:
-    pressed_keys = pygame.key.get_pressed()
-
-    # Process events that have happened since the last frame:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            pygame.quit()
-            sys.exit()
-
-    # Update the display
-    display.clear()
-    player1.rect = player1.player_collide_rect()
-    player2.rect = player2.player_collide_rect()
-    blocks = generate_blocks(display)
-    player1_rects = [player2]
-    player2_rects = [player1]
-    for block in blocks:
-        block.render(display)
-        player1_rects.append(block)
-        player2_rects.append(block)
-
-    player1.update(pressed_keys, player1_rects)
-    player1.render()
-    player2.update(pressed_keys, player2_rects)
-    player2.render()
-    pygame.display.update()
-    # Use the FPS clock to maintain smooth animation
-    FPS_CLOCK.tick(FPS)
+def tilemap_blocks(tiles: tilemap.TileMap):
+    """Turns a tile map into blocks, joining neighbouring tiles into big blocks."""
+    blocks = []
+    for rect, tile in tiles.merged_rects():
+        blocks.append(Block(x=rect.x, y=rect.bottom, width=rect.width, height=rect.height,
+                            color=tiles.legend[tile]))
+
+    # Left and right edges to prevent player from falling to infinity
+    blocks.append(Block(x=-100, y=tiles.height, height=tiles.height, width=100, color=BLUE))
+    blocks.append(Block(x=tiles.width, y=tiles.height, height=tiles.height, width=100, color=BLUE))
+    return blocks
+
+
+def tilemap_moving_blocks(tiles: tilemap.TileMap):
+    """Makes a PathBlock or FallingBlock for each of the tile map's platforms."""
+    size = tiles.tile_size
+    blocks = []
+    for platform in tiles.platforms:
+        column, row = platform["at"]
+        width = platform.get("width", 1) * size
+        height = platform.get("height", 1) * size
+        color = tiles.legend[platform.get("tile", tilemap.PLATFORM_TILE)]
+        x = column * size
+        y = row * size + height
+        if platform.get("falls", False):
+            blocks.append(FallingBlock(x=x, y=y, width=width, height=height, color=color))
+        else:
+            path = [(c * size, r * size) for c, r in platform["path"]]
+            blocks.append(PathBlock(x=x, y=y, width=width, height=height, color=color,
+                                    path=path, speed=platform.get("speed", 2)))
+    return blocks
+
+
+def chunk_block(x: int, y: int, width: int, height: int, color):
+    """Turns a block from a chunk (x and y are its top left) into a Block."""
+    return Block(x=x, y=y + height, width=width, height=height, color=color)
+
+
+# A key script is a list of (number of frames, keys held down) steps.
+# This one walks both robots towards the wall, jumps, and walks back.
+DEMO_SCRIPT = [
+    (30, []),
+    (40, [pygame.K_d, pygame.K_k]),
+    (20, [pygame.K_d, pygame.K_w, pygame.K_k, pygame.K_o]),
+    (40, [pygame.K_a, pygame.K_SEMICOLON]),
+    (20, [pygame.K_w, pygame.K_o]),
+]
+
+
+def scripted_keys(script, frames: int):
+    """Yields one KeyState per frame, repeating the script until frames run out."""
+    states = [(count, KeyState(keys)) for count, keys in script]
+    frame = 0
+    while frame < frames:
+        for count, state in states:
+            for i in range(count):
+                if frame == frames:
+                    return
+                yield state
+                frame = frame + 1
+
+
+# A Bot presses the keys for a player instead of a person. It picks
+# something to do, keeps doing it for a while, then picks again. Each choice
+# comes from random numbers seeded with the bot's seed and how many choices
+# it has made, so replays stay the same, and a rewound bot makes the same
+# choices again without having to remember a whole random number generator.
+class Bot:
+    KEYS = ("left", "right", "jump")
+    MOVES = ([], ["left"], ["right"])
+
+    def __init__(self, seed: int):
+        self.seed = seed
+        self.choices = 0
+        self.pressed_keys = KeyState()
+        self.steps_left = 0
+
+    def keys(self) -> KeyState:
+        """Returns the keys to hold down for the next physics step."""
+        if self.steps_left == 0:
+            numbers = random.Random(self.seed * 1000003 + self.choices)
+            self.choices = self.choices + 1
+            keys = numbers.choice(self.MOVES)
+            if numbers.random() < 0.3:
+                keys = keys + ["jump"]
+            self.pressed_keys = KeyState(keys)
+            self.steps_left = numbers.randint(10, 60)
+        self.steps_left = self.steps_left - 1
+        return self.pressed_keys
+
+    def save_state(self):
+        pressed = 0
+        for i, key in enumerate(self.KEYS):
+            if self.pressed_keys[key]:
+                pressed = pressed | (1 << i)
+        return (self.choices, self.steps_left, pressed)
+
+    def load_state(self, state):
+        self.choices, self.steps_left, pressed = state
+        self.pressed_keys = KeyState(key for i, key in enumerate(self.KEYS) if pressed & (1 << i))
+
+
+# Holds everything that makes up one game: the display, the level and the
+# players. The main loop just calls update and render once per frame.
+class Game:
+    def __init__(self, headless=False, dirty_rects=DIRTY_RECTS, level_path=None, chunk_source=None,
+                 scale: float = 1, fullscreen=False, renderer="software", humans: int = 2,
+                 bots: int = 0, key_bindings=KEY_BINDINGS, pixel_collisions=PIXEL_COLLISIONS,
+                 rewind_seconds: float = 0):
+        if headless:
+            # The dummy video driver lets pygame run without a screen
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
+        pygame.init()
+        if renderer == "texture" and texture_display.video is not None:
+            self.display = texture_display.TextureDisplay(fullscreen)
+        else:
+            self.display = Display(dirty_rects, scale, fullscreen)
+        self.timer = FrameTimer(FRAME_PHASES)
+        # How many physics steps back the game can be rewound. Remembering
+        # them costs a little time every step, so it is off unless asked for.
+        self.rewind_steps = int(rewind_seconds * PHYSICS_FPS)
+        self.history = None
+        load_sprites()
+        self.display.use_sprites(ROBOT_SPRITES)
+        players = []
+        for left_key, right_key, jump_key in key_bindings[:humans]:
+            players.append(Player(self.display, left_key, right_key, jump_key, pixel_collisions))
+        # Maps each bot's player to the Bot that drives it
+        self.bots = {}
+        for i in range(bots):
+            player = Player(self.display, *Bot.KEYS, pixel_collisions)
+            self.bots[player] = Bot(i)
+            players.append(player)
+        # Spread the players out evenly, from the left edge to the right
+        # edge. If they don't all fit side by side, the rest start a row
+        # higher and land on the heads of the row below.
+        width = PLAYER_IDLE_IMG.get_width()
+        room = self.display.width - 10 - width
+        per_row = min(len(players), room // width + 1)
+        spacing = room / max(1, per_row - 1)
+        for i, player in enumerate(players):
+            player.x = 10 + int((i % per_row) * spacing)
+            player.y = 10 - (i // per_row) * PLAYER_IDLE_IMG.get_height()
+            player.save_position()
+
+        # The blocks only change when the tile map is edited, so we only
+        # build them once up front.
+        self.tiles = None
+        self.tiles_version = None
+        # Big worlds are streamed in a chunk at a time as the players move
+        self.streamer = None
+        if chunk_source is not None:
+            self.level = Level()
+            # Headless runs load chunks straight away instead of on a thread,
+            # so a replay always sees the same blocks on the same step.
+            self.streamer = chunks.ChunkStreamer(self.level, chunk_source, chunk_block,
+                                                 threaded=not headless)
+            self.streamer.load_now(players)
+            self.display.camera.world = pygame.Rect(chunk_source.world)
+        elif level_path is None:
+            self.level = Level(generate_blocks(self.display))
+        else:
+            self.tiles = tilemap.load(level_path)
+            self.tiles_version = self.tiles.version
+            self.level = Level(tilemap_blocks(self.tiles) + tilemap_moving_blocks(self.tiles))
+            self.display.camera.world = pygame.Rect(0, 0, self.tiles.width, self.tiles.height)
+        self.reset_players(players)
+
+    def reset_players(self, players):
+        """Swaps in a new list of players."""
+        self.players = players
+        for player in players:
+            player.asleep = False
+        # Players move around every step, so instead of going in the level's
+        # SpatialHash they get their own sweep list.
+        self.sweep = PlayerSweep()
+        for player in players:
+            player.refresh_rect()
+            self.sweep.add(player)
+        self.collisions = CollisionIndex(self.level.index, self.sweep)
+        self.level_version = self.level.version
+        if self.rewind_steps > 0:
+            self.history = rewind.History(players + [self.bots[player] for player in players
+                                                     if player in self.bots]
+                                          + self.level.moving, self.rewind_steps)
+
+    def keys(self):
+        """Returns every key that controls a player at the keyboard."""
+        keys = []
+        for player in self.players:
+            if player not in self.bots:
+                keys.extend([player.move_left_key, player.move_right_key, player.jump_key])
+        return keys
+
+    def update(self, pressed_keys):
+        """Runs one physics step."""
+        if self.tiles is not None and self.tiles.version != self.tiles_version:
+            # Someone edited the tile map, so rebuild the blocks from it
+            # (moving blocks aren't part of the grid, so they are kept as they are)
+            self.level.replace_blocks(tilemap_blocks(self.tiles) + self.level.moving)
+            self.tiles_version = self.tiles.version
+        if self.streamer is not None:
+            self.streamer.update(self.players)
+        # Sleeping players haven't moved, so they are already up to date
+        for player in self.players:
+            if not player.asleep:
+                player.save_position()
+        if len(self.level.moving) > 0:
+            self.move_blocks()
+        for player in self.players:
+            if not player.asleep:
+                player.refresh_rect()
+        self.sweep.update()
+        # Only check sleepers' ground again when a block was added, removed
+        # or moved since last step
+        level_changed = self.level.version != self.level_version
+        self.level_version = self.level.version
+        for player in self.players:
+            bot = self.bots.get(player)
+            keys = bot.keys() if bot is not None else pressed_keys
+            if player.asleep:
+                if not player.wants_to_move(keys) and (
+                        not level_changed or player.on_ground(self.collisions)):
+                    player.rest()
+                    continue
+                player.asleep = False
+            player.update(keys, self.collisions)
+            player.keep_inside(self.display.camera.world)
+            player.asleep = player.settled()
+        if self.history is not None:
+            self.history.record()
+
+    def rewind(self) -> bool:
+        """Goes back one physics step. Returns False if there is no history
+        left to go back through."""
+        changed = self.history.rewind()
+        if changed is None:
+            return False
+        self.restored(changed)
+        return True
+
+    def save(self, path: str):
+        self.history.save(path)
+
+    def load(self, path: str):
+        self.restored(self.history.load(path))
+
+    def restored(self, items):
+        """Catches up with players, bots and blocks that were put back to an
+        earlier state."""
+        for item in items:
+            if isinstance(item, MovingBlock):
+                self.level.index.move(item)
+
+    def move_blocks(self):
+        """Moves the level's moving blocks and carries along the players
+        standing on them."""
+        riders = [player for player in self.players if player.riding()]
+        self.level.update(set(player.ground for player in riders))
+        for player in riders:
+            block = player.ground
+            if block.carries_riders() and (block.moved_x != 0 or block.moved_y != 0):
+                player.asleep = False
+                player.ride(self.collisions)
+
+    def render(self, alpha: float = 1):
+        self.display.camera.follow(self.players, alpha)
+        self.display.draw_background(self.level)
+        self.level.render_moving(self.display, alpha)
+        self.timer.mark("background")
+        for player in self.players:
+            player.render(alpha)
+        self.timer.mark("players")
+        self.display.draw_overlay(self.timer)
+        self.timer.mark("overlay")
+        self.display.render()
+        self.timer.mark("display")
+
+
+def run_headless(game: Game, key_states):
+    """Steps the game as fast as possible without drawing anything.
+    Returns the number of frames run and how many per second it managed."""
+    frames = 0
+    start = time.perf_counter()
+    for pressed_keys in key_states:
+        game.update(pressed_keys)
+        frames = frames + 1
+    elapsed = time.perf_counter() - start
+    return frames, frames / elapsed if elapsed > 0 else 0
+
+
+def finish(game: Game, recorder, record_path):
+    """Saves the recording, if there is one, and prints the final state."""
+    if recorder is not None:
+        recorder.save(record_path)
+        print("Recorded %d steps to %s" % (recorder.steps(), record_path))
+    print("Final state checksum " + replay.state_checksum(game.players, game.level.moving))
+
+
+def key_binding(names: str):
+    """Turns key names like "a,d,w" into a (left, right, jump) tuple of key
+    codes. Raises ValueError if they don't make sense."""
+    names = names.split(",")
+    if len(names) != 3:
+        raise ValueError("--keys needs three key names for each player (left,right,jump), not "
+                         + ",".join(names))
+    codes = []
+    for name in names:
+        try:
+            codes.append(pygame.key.key_code(name))
+        except ValueError:
+            raise ValueError("unknown key name '%s'" % name)
+    return tuple(codes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Robot platform challenge")
+    parser.add_argument("--headless", action="store_true",
+                        help="run the demo key script (or a replay) without a window as fast as possible")
+    parser.add_argument("--frames", type=int, default=10000,
+                        help="number of frames to run the demo key script for in headless mode")
+    parser.add_argument("--fps", type=int, default=FPS,
+                        help="frames to draw per second (the game speed stays the same)")
+    parser.add_argument("--record", metavar="FILE",
+                        help="save the keys pressed in each step to FILE when the game is closed")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="play back the keys recorded in FILE instead of using the keyboard")
+    parser.add_argument("--level", metavar="FILE",
+                        help="load the level from a tile map file, like levels/challenge.json")
+    parser.add_argument("--chunks", metavar="FILE",
+                        help="stream a big level from a chunk file made with chunks.py")
+    parser.add_argument("--seed", type=int,
+                        help="stream a generated world made from this seed")
+    parser.add_argument("--scale", type=float, default=1,
+                        help="draw at this fraction of the window size and stretch it to fit, "
+                             "e.g. 0.5 on a Raspberry Pi")
+    parser.add_argument("--fullscreen", action="store_true", help="fill the whole screen")
+    parser.add_argument("--renderer", choices=RENDERERS, default="software",
+                        help="draw with Surface blits or with SDL textures")
+    parser.add_argument("--players", type=int, default=2, help="players at the keyboard")
+    parser.add_argument("--bots", type=int, default=0, help="players moved by the computer")
+    parser.add_argument("--pixel-collisions", action="store_true",
+                        help="players bump into each other where their pixels touch")
+    parser.add_argument("--rewind", type=float, default=REWIND_SECONDS, metavar="SECONDS",
+                        help="how far back holding backspace can rewind the game, 0 to turn it off")
+    parser.add_argument("--keys", nargs="+", metavar="LEFT,RIGHT,JUMP",
+                        help="key names for each player at the keyboard, like a,d,w \"k,;,o\" left,right,up")
+    args = parser.parse_args()
+
+    if args.players < 0 or args.bots < 0:
+        parser.error("--players and --bots can't be less than 0")
+    if args.players + args.bots == 0:
+        parser.error("the game needs at least one player or bot")
+    if args.players > MAX_KEYBOARD_PLAYERS:
+        parser.error("at most %d players can share the keyboard" % MAX_KEYBOARD_PLAYERS)
+    # "not bigger than 0" also catches nan, which isn't bigger or smaller than anything
+    if not args.scale > 0 or math.isinf(args.scale):
+        parser.error("--scale has to be a number bigger than 0, like 0.5")
+    if args.level:
+        # Check the level now, so a mistake in it is a message instead of a crash
+        try:
+            tilemap.load(args.level)
+        except (OSError, ValueError) as error:
+            parser.error(str(error))
+    key_bindings = KEY_BINDINGS
+    if args.keys:
+        try:
+            key_bindings = [key_binding(keys) for keys in args.keys]
+        except ValueError as error:
+            parser.error(str(error))
+    if args.players > len(key_bindings):
+        parser.error("only %d players have keys, use --keys to add more" % len(key_bindings))
+    players = {"humans": args.players, "bots": args.bots, "key_bindings": key_bindings,
+               "pixel_collisions": args.pixel_collisions}
+
+    chunk_source = None
+    if args.chunks:
+        chunk_source = chunks.ChunkFile(args.chunks)
+    elif args.seed is not None:
+        chunk_source = chunks.GeneratedChunks(args.seed, GENERATED_WORLD_CHUNKS)
+
+    # When replaying, each physics step takes the next recorded key state
+    # instead of looking at the keyboard.
+    # Everything that changes how the game plays. Replays save it, so they
+    # are only played back in the same kind of game they were recorded in.
+    setup = {"players": args.players, "bots": args.bots, "pixel_collisions": args.pixel_collisions,
+             "level": os.path.normpath(args.level) if args.level else None,
+             "chunks": os.path.normpath(args.chunks) if args.chunks else None, "seed": args.seed}
+    keys = [key for binding in key_bindings[:args.players] for key in binding]
+    replay_states = None
+    if args.replay:
+        try:
+            recording = replay.load(args.replay)
+        except (OSError, ValueError) as error:
+            parser.error(str(error))
+        differences = replay.setup_differences(recording.setup, setup)
+        if len(differences) > 0:
+            parser.error(args.replay + " was recorded in a different game: " + ", ".join(differences))
+        if recording.keys != keys:
+            parser.error(args.replay + " was recorded with different --keys")
+        replay_states = replay.replay_keys(recording)
+
+    if args.headless:
+        game = Game(headless=True, level_path=args.level, chunk_source=chunk_source,
+                    scale=args.scale, fullscreen=args.fullscreen, renderer=args.renderer, **players)
+        if replay_states is None:
+            replay_states = scripted_keys(DEMO_SCRIPT, args.frames)
+        frames, steps_per_second = run_headless(game, replay_states)
+        print("%d frames, %.0f frames per second" % (frames, steps_per_second))
+        finish(game, None, None)
+        return
+
+    game = Game(level_path=args.level, chunk_source=chunk_source, scale=args.scale,
+                fullscreen=args.fullscreen, renderer=args.renderer, rewind_seconds=args.rewind,
+                **players)
+    recorder = None
+    if args.record:
+        recorder = replay.Recorder(game.keys(), setup)
+    # Time that has passed but hasn't been simulated by physics steps yet
+    unsimulated_time = 0
+
+    # Main game loop that is executed FPS times per second.
+    # Each time through the loop is one frame in the game.
+    while True:
+        game.timer.start_frame()
+        # Each time we execute a frame, we ask pygame to tell us the state of
+        # all the keyboard keys:
+        pressed_keys = pygame.key.get_pressed()
+
+        # Process events that have happened since the last frame:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                finish(game, recorder, args.record)
+                pygame.quit()
+                sys.exit()
+            if event.type == pygame.KEYDOWN:
+                if event.key == TIMER_KEY:
+                    game.timer.toggle()
+                elif event.key == TIMER_DUMP_KEY and game.timer.enabled:
+                    game.timer.dump(FRAME_TIMES_FILE)
+                elif event.key == SAVE_KEY and game.history is not None:
+                    game.save(SAVE_FILE)
+                    print("Saved the game to " + SAVE_FILE)
+                elif event.key == LOAD_KEY and game.history is not None and os.path.exists(SAVE_FILE):
+                    try:
+                        game.load(SAVE_FILE)
+                        print("Loaded the game from " + SAVE_FILE)
+                    except (OSError, ValueError) as error:
+                        print("Couldn't load the game: " + str(error))
+        game.timer.mark("events")
+
+        # Holding the rewind key runs the steps backwards instead. Replays
+        # can't be rewound because they play back recorded keys.
+        rewinding = (pressed_keys[REWIND_KEY] and game.history is not None
+                     and replay_states is None)
+
+        # Run as many physics steps as fit in the time since the last frame.
+        # Drawing fast adds up to less than one step, drawing slowly to more.
+        while unsimulated_time >= PHYSICS_STEP:
+            if rewinding:
+                # Forget the recorded keys for the step we went back over, so
+                # the recording still plays back what happened
+                if game.rewind() and recorder is not None:
+                    recorder.unrecord()
+                unsimulated_time = unsimulated_time - PHYSICS_STEP
+                continue
+            if replay_states is not None:
+                pressed_keys = next(replay_states, None)
+                if pressed_keys is None:
+                    # The replay is over
+                    finish(game, recorder, args.record)
+                    pygame.quit()
+                    sys.exit()
+            if recorder is not None:
+                recorder.record(pressed_keys)
+            game.update(pressed_keys)
+            unsimulated_time = unsimulated_time - PHYSICS_STEP
+        game.timer.mark("physics")
+
+        # Update the display, drawing players part way to their next step
+        game.render(unsimulated_time / PHYSICS_STEP)
+        game.timer.end_frame()
+        # Use the FPS clock to maintain smooth animation
+        frame_time = FPS_CLOCK.tick(args.fps) / 1000
+        unsimulated_time = unsimulated_time + min(frame_time, MAX_FRAME_TIME)
+
+
+if __name__ == "__main__":
+    main()
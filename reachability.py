@@ -0,0 +1,341 @@
+import argparse
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Tuple
+
+import pygame
+import game_09_challenge as game_09
+import tilemap
+from game_09_challenge import Player
+
+
+# Works out where a robot can get to in a level without playing it.
+#
+# Jumping always goes the same way: the same heights, step by step, every
+# time. So we work out that jump arc once, then only have to try it from the
+# places a robot can stand. A robot standing on a ledge can walk anywhere
+# along it, so the level turns into a graph: ledges are the places, and a
+# jump (or walking off an edge) that goes from one ledge to another
+# connects them. Anything the robot can reach is a ledge we can get to in
+# that graph.
+#
+# The steps are made by Player.update itself, so the solver can't disagree
+# with the game. Only one robot is moved, so the other robot can't be used
+# as a step.
+
+PLAYER1_SPAWN = (10, 10)
+# How many physics steps to follow a jump or fall for before giving up
+MAX_STEPS = 200
+
+
+def jump_forces():
+    """How far the robot moves up in each step of a jump, starting from the
+    first one. Once the jump is falling at full speed it stays the same, so
+    the last entry repeats forever."""
+    forces = []
+    velocity = game_09.JUMP_START_VELOCITY
+    while True:
+        force = Player.JUMP_MASS * velocity
+        if force + Player.MAX_FORCE < 0:
+            force = -Player.MAX_FORCE
+        forces.append(force)
+        if force == -Player.MAX_FORCE:
+            return forces
+        velocity = velocity - 1
+
+
+JUMP_FORCES = jump_forces()
+
+
+def arc_bounds(direction: int, steps: int = MAX_STEPS) -> Tuple[int, int, int, int]:
+    """The furthest left, up, right and down a jump moving in direction can
+    go in steps, if nothing is in the way."""
+    x = y = 0
+    left = top = right = bottom = 0
+    for step in range(steps):
+        x = x + direction * Player.VELOCITY
+        y = y - JUMP_FORCES[min(step, len(JUMP_FORCES) - 1)]
+        left = min(left, x)
+        right = max(right, x)
+        top = min(top, y)
+        bottom = max(bottom, y)
+    return left, top, right, bottom
+
+
+def hop_size():
+    """How many steps a jump takes to come back down to where it started,
+    and how high it goes on the way."""
+    y = 0
+    top = 0
+    for step, force in enumerate(JUMP_FORCES):
+        y = y - force
+        top = min(top, y)
+        if y >= 0:
+            return step + 1, -top
+    raise ValueError("the jump never comes back down")
+
+
+HOP_STEPS, HOP_HEIGHT = hop_size()
+
+
+# The keys a Ghost's Player is pressed with, for each direction and jump
+GHOST_LEFT, GHOST_RIGHT, GHOST_JUMP = pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP
+GHOST_KEYS = {
+    (direction, jump): game_09.KeyState(
+        ([GHOST_LEFT] if direction == -1 else [GHOST_RIGHT] if direction == 1 else [])
+        + ([GHOST_JUMP] if jump else []))
+    for direction in (-1, 0, 1) for jump in (False, True)
+}
+
+
+# Stands in for the game's CollisionIndex when there is only one robot and a
+# short list of blocks that never move. Every query just gives back all of
+# the blocks in level order, and Player picks out the ones it touches.
+class StillBlocks:
+    def __init__(self, blocks):
+        self.items = blocks
+        # Player asks index.blocks for blocks and index.players for other
+        # players. Everything here is a block.
+        self.blocks = self
+        self.players = []
+
+    def query(self, rect: pygame.Rect, ignore=None, dynamic=True) -> list:
+        return self.items
+
+    def __contains__(self, item):
+        return True
+
+
+# One robot, moved by a real Player in a level that never moves. It is never
+# drawn, so it doesn't need a display.
+class Ghost:
+    def __init__(self, x: int, y: int, index: StillBlocks):
+        self.player = Player(None, GHOST_LEFT, GHOST_RIGHT, GHOST_JUMP)
+        self.player.x = x
+        self.player.y = y
+        self.index = index
+
+    def step(self, direction: int, jump: bool):
+        """One physics step holding left (-1), right (1) or neither (0), and maybe jump."""
+        self.player.update(GHOST_KEYS[(direction, jump)], self.index)
+
+    def standing(self) -> bool:
+        return not self.player.is_jumping and not self.player.is_falling
+
+
+# A place the robot can stand: the robot's top is at y and it can walk
+# anywhere from left to right (in steps of Player.VELOCITY from left).
+Ledge = Tuple[int, int, int]
+
+
+class Reachability:
+    def __init__(self, rects):
+        self.rects = [pygame.Rect(rect) for rect in rects]
+        self.blocks = [game_09.chunk_block(*rect, game_09.BLUE) for rect in self.rects]
+        self.index = StillBlocks(self.blocks)
+        # The robot is as big as its sprite
+        robot = Ghost(0, 0, self.index).player
+        self.width = robot.player_width
+        self.height = robot.player_height
+        # Nothing can land below the lowest block, so arcs stop there
+        self.bottom = max(rect.bottom for rect in self.rects)
+        self.arcs = {direction: arc_bounds(direction) for direction in (-1, 0, 1)}
+        # Maps y to the ledges found so far at that height
+        self.ledges: Dict[int, list] = {}
+        # Maps each ledge to the ledges one jump or fall away
+        self.edges: Dict[Ledge, set] = {}
+
+    def nearby_blocks(self, x: int, y: int, direction: int):
+        """The blocks a jump from x, y in direction could touch."""
+        left, top, right, bottom = self.arcs[direction]
+        area = pygame.Rect(x + left, y + top, right - left + self.width,
+                           min(bottom + self.height + 1, self.bottom - y - top))
+        return [self.blocks[i] for i in area.collidelistall(self.rects)]
+
+    def hop_is_clear(self, x: int, y: int, landing_x: int) -> bool:
+        """Is there nothing but the ground in the way of a jump from x, y to landing_x?"""
+        area = pygame.Rect(min(x, landing_x), y - HOP_HEIGHT, abs(landing_x - x) + self.width,
+                           HOP_HEIGHT + self.height + 1)
+        ground = y + self.height
+        return all(self.rects[i].top == ground for i in area.collidelistall(self.rects))
+
+    def walk(self, x: int, y: int, direction: int) -> int:
+        """Walks a robot standing at x, y in direction until it would fall off
+        or a wall stops it. Returns the last x it was standing at."""
+        ghost = Ghost(x, y, self.index)
+        # A robot stuck inside a block can get pushed back and forth, so we
+        # also stop if it gets back to somewhere it has already been.
+        visited = {x}
+        while True:
+            last_x = ghost.player.x
+            ghost.step(direction, False)
+            if not ghost.standing() or ghost.player.x in visited:
+                return last_x
+            visited.add(ghost.player.x)
+
+    def ledge_at(self, x: int, y: int) -> Ledge:
+        for ledge in self.ledges.get(y, []):
+            if ledge[1] <= x <= ledge[2]:
+                return ledge
+        ledge = (y, min(x, self.walk(x, y, -1)), max(x, self.walk(x, y, 1)))
+        self.ledges.setdefault(y, []).append(ledge)
+        return ledge
+
+    def follow(self, x: int, y: int, direction: int, jump: bool):
+        """Moves a robot standing at x, y until it is standing again.
+        Returns the ledge it ends up on, or None if it never lands."""
+        blocks = self.nearby_blocks(x, y, direction)
+        # With nothing around but the ground it is standing on, a jump can
+        # only come back down on the same ground.
+        if jump and len(blocks) == 1 and blocks[0].rect.top == y + self.height:
+            return None
+        ghost = Ghost(x, y, StillBlocks(blocks))
+        ghost.step(direction, jump)
+        for step in range(MAX_STEPS):
+            if ghost.standing():
+                return self.ledge_at(ghost.player.x, ghost.player.y)
+            ghost.step(direction, False)
+        return None
+
+    def neighbours(self, ledge: Ledge):
+        if ledge in self.edges:
+            return self.edges[ledge]
+        y, left, right = ledge
+        found = set()
+        starts = list(range(left, right + 1, Player.VELOCITY))
+        if starts[-1] != right:
+            starts.append(right)
+        for x in starts:
+            for direction in (-1, 0, 1):
+                # Most jumps just hop along the same ledge, which we can see
+                # without following them.
+                landing_x = x + direction * Player.VELOCITY * HOP_STEPS
+                if left <= landing_x <= right and self.hop_is_clear(x, y, landing_x):
+                    continue
+                found.add(self.follow(x, y, direction, True))
+        # Walking off either end
+        found.add(self.follow(left, y, -1, False))
+        found.add(self.follow(right, y, 1, False))
+        found.discard(None)
+        found.discard(ledge)
+        self.edges[ledge] = found
+        return found
+
+    def spawn_ledge(self, spawn=PLAYER1_SPAWN):
+        """Where a robot dropped in at spawn lands."""
+        x, y = spawn
+        return self.follow(x, y, 0, False)
+
+    def reachable(self, spawn=PLAYER1_SPAWN):
+        """Returns every ledge a robot can get to from spawn."""
+        start = self.spawn_ledge(spawn)
+        if start is None:
+            return set()
+        seen = {start}
+        todo = [start]
+        while len(todo) > 0:
+            for ledge in self.neighbours(todo.pop()):
+                if ledge not in seen:
+                    seen.add(ledge)
+                    todo.append(ledge)
+        return seen
+
+    def can_reach(self, x: int, spawn=PLAYER1_SPAWN) -> bool:
+        """Can the robot's x get to x, starting from spawn?"""
+        return any(left <= x <= right for y, left, right in self.reachable(spawn))
+
+
+def level_rects(blocks):
+    """Turns blocks into plain (x, y, width, height) tuples that can be sent to
+    other processes."""
+    return [tuple(block.rect) for block in blocks]
+
+
+def tilemap_rects(path: str):
+    return level_rects(game_09.tilemap_blocks(tilemap.load(path)))
+
+
+def solve(job):
+    rects, spawn, x = job
+    return Reachability(rects).can_reach(x, spawn)
+
+
+def solve_many(levels, spawn, x: int, workers: int = None):
+    """Checks lots of levels at once, spread over a pool of processes.
+    Returns one True or False per level."""
+    jobs = [(rects, spawn, x) for rects in levels]
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(solve, jobs, chunksize=max(1, len(jobs) // 64)))
+
+
+def random_levels(rects, count: int, platforms: int, seed: int, width: int, height: int):
+    """Makes candidate levels by adding random platforms to rects."""
+    rng = random.Random(seed)
+    levels = []
+    for i in range(count):
+        level = list(rects)
+        for j in range(platforms):
+            level.append((rng.randrange(0, width - 100, 20), rng.randrange(200, height - 40, 20),
+                          rng.randrange(40, 200, 20), 20))
+        levels.append(level)
+    return levels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check which parts of a level a robot can reach")
+    parser.add_argument("--level", default="levels/challenge.json", help="tile map level to check")
+    parser.add_argument("--generated", action="store_true",
+                        help="check the level generate_blocks makes instead of a tile map")
+    parser.add_argument("--x", type=int,
+                        help="the x player 1 has to get to (default: past the middle of the level)")
+    parser.add_argument("--candidates", type=int, default=0,
+                        help="also check this many copies of the level with random platforms added")
+    parser.add_argument("--platforms", type=int, default=4, help="random platforms per candidate")
+    parser.add_argument("--workers", type=int, help="processes to use for the candidates")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.generated:
+        # generate_blocks makes the level as big as the display. The dummy
+        # video driver lets us make one without opening a window.
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+        pygame.init()
+        display = game_09.Display()
+        name = "generated level"
+        rects = level_rects(game_09.generate_blocks(display))
+        width, height = display.width, display.height
+    else:
+        try:
+            tiles = tilemap.load(args.level)
+        except (OSError, ValueError) as error:
+            parser.error(str(error))
+        name = args.level
+        rects = level_rects(game_09.tilemap_blocks(tiles))
+        width, height = tiles.width, tiles.height
+    target = args.x if args.x is not None else width // 2 + 40
+
+    start = time.perf_counter()
+    solver = Reachability(rects)
+    reached = solver.can_reach(target)
+    elapsed = time.perf_counter() - start
+    print("%s: player 1 %s reach x=%d (%d ledges explored, %.1f ms)" % (
+        name, "can" if reached else "can't", target, len(solver.edges), elapsed * 1000))
+
+    if args.candidates > 0:
+        levels = random_levels(rects, args.candidates, args.platforms, args.seed, width, height)
+        start = time.perf_counter()
+        results = solve_many(levels, PLAYER1_SPAWN, target, args.workers)
+        elapsed = time.perf_counter() - start
+        print("%d of %d candidate levels let player 1 reach x=%d (%.2f s)" % (
+            sum(results), len(results), target, elapsed))
+        for level, result in zip(levels, results):
+            if result:
+                print("First one adds platforms at " + ", ".join(
+                    "(%d, %d, %d, %d)" % rect for rect in level[len(rects):]))
+                break
+
+
+if __name__ == "__main__":
+    main()
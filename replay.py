@@ -0,0 +1,147 @@
+import hashlib
+import json
+import struct
+from typing import List
+
+
+# A replay file stores which keys were held down for every physics step.
+# Most of the time the same keys stay held for many steps in a row, so we
+# store runs instead: "these keys for this many steps". That is called
+# run-length encoding.
+#
+# The file is a header, the game's setup, the list of key codes that were
+# recorded, then the runs. Each run is a step count and a bit mask where bit
+# i is set if the i-th recorded key was held down.
+#
+# The setup is everything that changes how the game plays (how many players
+# and bots, which level, ...), saved as JSON. The same keys only make the
+# same game if they are played back with the same setup.
+REPLAY_MAGIC = b"RPLY"
+REPLAY_VERSION = 2
+# magic, version, number of keys, number of runs, length of the setup
+REPLAY_HEADER = struct.Struct("<4sIIII")
+REPLAY_KEY = struct.Struct("<I")
+REPLAY_RUN = struct.Struct("<II")
+# The key mask in each run is 32 bits, one for each recorded key
+MAX_KEYS = 32
+
+
+# Pretends to be the result of pygame.key.get_pressed(), so a script or a
+# replay can decide which keys are held down instead of the keyboard.
+class KeyState:
+    def __init__(self, pressed_keys=()):
+        self.pressed_keys = frozenset(pressed_keys)
+
+    def __getitem__(self, key):
+        return key in self.pressed_keys
+
+
+class Recorder:
+    def __init__(self, keys: List[int], setup: dict = None):
+        if len(keys) > MAX_KEYS:
+            raise ValueError("a replay can only record %d keys, not %d" % (MAX_KEYS, len(keys)))
+        self.keys = list(keys)
+        self.setup = dict(setup or {})
+        # Each run is [number of steps, key mask]
+        self.runs = []
+
+    def record(self, pressed_keys):
+        mask = 0
+        for i, key in enumerate(self.keys):
+            if pressed_keys[key]:
+                mask = mask | (1 << i)
+        if len(self.runs) > 0 and self.runs[-1][1] == mask:
+            self.runs[-1][0] = self.runs[-1][0] + 1
+        else:
+            self.runs.append([1, mask])
+
+    def unrecord(self):
+        """Forgets the last recorded step."""
+        if len(self.runs) == 0:
+            return
+        self.runs[-1][0] = self.runs[-1][0] - 1
+        if self.runs[-1][0] == 0:
+            self.runs.pop()
+
+    def steps(self):
+        return sum(count for count, mask in self.runs)
+
+    def save(self, path: str):
+        setup = json.dumps(self.setup, sort_keys=True).encode()
+        with open(path, "wb") as f:
+            f.write(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, len(self.keys), len(self.runs),
+                                       len(setup)))
+            f.write(setup)
+            for key in self.keys:
+                f.write(REPLAY_KEY.pack(key))
+            for count, mask in self.runs:
+                f.write(REPLAY_RUN.pack(count, mask))
+
+
+def load(path: str) -> Recorder:
+    """Reads a replay file back into a Recorder. Raises ValueError if it
+    isn't a replay file or is cut short."""
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        return read_recording(data, path)
+    except struct.error:
+        raise ValueError(path + " is cut short")
+
+
+def read_recording(data: bytes, path: str) -> Recorder:
+    magic, version, key_count, run_count, setup_length = REPLAY_HEADER.unpack_from(data, 0)
+    if magic != REPLAY_MAGIC:
+        raise ValueError(path + " is not a replay file")
+    if version != REPLAY_VERSION:
+        raise ValueError(path + " was recorded by a different version of the game")
+    offset = REPLAY_HEADER.size
+    if offset + setup_length > len(data):
+        raise struct.error("setup is cut short")
+    try:
+        setup = json.loads(data[offset:offset + setup_length].decode())
+    except ValueError:
+        raise ValueError(path + " has a broken setup in it")
+    offset = offset + setup_length
+    keys = []
+    for i in range(key_count):
+        keys.append(REPLAY_KEY.unpack_from(data, offset)[0])
+        offset = offset + REPLAY_KEY.size
+    recording = Recorder(keys, setup)
+    for i in range(run_count):
+        count, mask = REPLAY_RUN.unpack_from(data, offset)
+        recording.runs.append([count, mask])
+        offset = offset + REPLAY_RUN.size
+    return recording
+
+
+def replay_keys(recording: Recorder):
+    """Yields one KeyState per recorded physics step."""
+    for count, mask in recording.runs:
+        state = KeyState(key for i, key in enumerate(recording.keys) if mask & (1 << i))
+        for i in range(count):
+            yield state
+
+
+def setup_differences(recorded: dict, current: dict) -> List[str]:
+    """Lists each part of the setup that isn't the same as when it was
+    recorded, like "bots 2 (now 0)"."""
+    differences = []
+    for name in sorted(set(recorded) | set(current)):
+        if recorded.get(name) != current.get(name):
+            differences.append("%s %s (now %s)" % (name, recorded.get(name), current.get(name)))
+    return differences
+
+
+def state_checksum(players, blocks=()) -> str:
+    """Returns a short fingerprint of everything that affects the physics:
+    the players and the moving blocks. Two runs that end with the same
+    checksum ended in the same state."""
+    digest = hashlib.sha256()
+    for player in players:
+        digest.update(repr((player.x, player.y, player.jumping_velocity, player.is_jumping,
+                            player.is_falling, player.last_move,
+                            player.last_move_repeat_count)).encode())
+    for block in blocks:
+        digest.update(repr(block.save_state()).encode())
+    return digest.hexdigest()[:16]
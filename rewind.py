@@ -0,0 +1,184 @@
+import struct
+import sys
+import zlib
+from array import array
+from collections import deque
+
+
+# A History remembers the last few minutes of a game so it can be played
+# backwards. Everything that changes while the game runs (each player's
+# position, jump and animation, each bot's plans, each moving block) is kept
+# as one long list of whole numbers, the "state".
+#
+# Keeping a copy of the whole state for every step would use lots of memory,
+# but from one step to the next only a few numbers change. So for each step
+# we only keep an "undo": which numbers changed and by how much. Stepping
+# back is just taking those changes away again. Changes are usually small
+# (a robot moves 8 pixels), so most undos fit in 2 byte numbers.
+#
+# Every object in a History needs save_state(), which returns a tuple of
+# whole numbers, always the same length, and load_state(state), which puts
+# them back.
+REWIND_MAGIC = b"RWND"
+REWIND_VERSION = 2
+# magic, version, number of objects, length of the whole state, number of
+# undos, and a CRC32 checksum of everything after the header
+REWIND_HEADER = struct.Struct("<4sIIIII")
+# Each undo in a file starts with its number type and how many numbers it has
+REWIND_UNDO = struct.Struct("<cI")
+# Array type codes for 2 byte and 4 byte numbers
+SMALL = "h"
+BIG = "i"
+
+
+class History:
+    def __init__(self, objects, size: int):
+        self.objects = list(objects)
+        # Each object's numbers, kept as one tuple per object so that objects
+        # that didn't change can be skipped with one comparison
+        self.states = [item.save_state() for item in self.objects]
+        # Where each object's numbers start in the whole state, and which
+        # object each number in the whole state belongs to
+        self.offsets = []
+        self.owners = []
+        for number, state in enumerate(self.states):
+            self.offsets.append(len(self.owners))
+            self.owners.extend([number] * len(state))
+        # The newest undo is on the right. Once there are size of them, adding
+        # one drops the oldest, so this is a ring buffer.
+        self.undos = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self.undos)
+
+    def record(self):
+        """Call this after each physics step."""
+        # Pairs of (where in the whole state, how much it changed by)
+        undo = []
+        for number, item in enumerate(self.objects):
+            before = self.states[number]
+            after = item.save_state()
+            if before != after:
+                offset = self.offsets[number]
+                for i, (old, new) in enumerate(zip(before, after)):
+                    if old != new:
+                        undo.append(offset + i)
+                        undo.append(new - old)
+                self.states[number] = after
+        self.undos.append(pack_undo(undo))
+
+    def rewind(self) -> list:
+        """Goes back one step. Returns the objects that changed, or None if
+        there is nothing left to go back to."""
+        if len(self.undos) == 0:
+            return None
+        undo = unpack_undo(self.undos.pop())
+        changed = {}
+        for j in range(0, len(undo), 2):
+            i = undo[j]
+            number = self.owners[i]
+            state = changed.get(number)
+            if state is None:
+                state = list(self.states[number])
+                changed[number] = state
+            state[i - self.offsets[number]] = state[i - self.offsets[number]] - undo[j + 1]
+        items = []
+        for number, state in changed.items():
+            self.states[number] = tuple(state)
+            items.append(self.load_object(number))
+        return items
+
+    def load_object(self, number: int):
+        item = self.objects[number]
+        item.load_state(self.states[number])
+        return item
+
+    def save(self, path: str):
+        """Writes the current state and every undo to a file."""
+        state = array(BIG)
+        for item_state in self.states:
+            state.extend(item_state)
+        parts = [little_endian(state).tobytes()]
+        for undo in self.undos:
+            numbers = unpack_undo(undo)
+            parts.append(REWIND_UNDO.pack(numbers.typecode.encode(), len(numbers)))
+            parts.append(little_endian(numbers).tobytes())
+        body = b"".join(parts)
+        with open(path, "wb") as f:
+            f.write(REWIND_HEADER.pack(REWIND_MAGIC, REWIND_VERSION, len(self.objects), len(state),
+                                       len(self.undos), zlib.crc32(body)))
+            f.write(body)
+
+    def load(self, path: str) -> list:
+        """Reads a file written by save, which has to be from a game with the
+        same players and moving blocks. Puts every object back the way it was
+        and returns them. Raises ValueError if the file can't be used, without
+        changing anything."""
+        with open(path, "rb") as f:
+            data = f.read()
+        try:
+            undos, state = self.read(data, path)
+        except struct.error:
+            raise ValueError(path + " is cut short")
+        for number in range(len(self.objects)):
+            start = self.offsets[number]
+            self.states[number] = tuple(state[start:start + len(self.states[number])])
+        self.undos.clear()
+        self.undos.extend(undos)
+        return [self.load_object(number) for number in range(len(self.objects))]
+
+    def read(self, data: bytes, path: str):
+        """Checks a saved game fits this game and reads its undos and state."""
+        magic, version, objects, length, count, checksum = REWIND_HEADER.unpack_from(data, 0)
+        if magic != REWIND_MAGIC or version != REWIND_VERSION:
+            raise ValueError(path + " is not a saved game")
+        if zlib.crc32(data[REWIND_HEADER.size:]) != checksum:
+            raise ValueError(path + " is damaged or cut short")
+        if objects != len(self.objects) or length != len(self.owners):
+            raise ValueError(path + " was saved from a game with different players, bots or "
+                             "moving blocks")
+        offset = REWIND_HEADER.size
+        state, offset = read_numbers(data, offset, BIG, length)
+        undos = []
+        for i in range(count):
+            typecode, undo_length = REWIND_UNDO.unpack_from(data, offset)
+            numbers, offset = read_numbers(data, offset + REWIND_UNDO.size,
+                                           typecode.decode("latin-1"), undo_length)
+            # Every other number says where in the state a change goes
+            if undo_length % 2 != 0 or any(at < 0 or at >= length for at in numbers[::2]):
+                raise ValueError(path + " has a broken undo in it")
+            undos.append(numbers.typecode.encode() + numbers.tobytes())
+        return undos, state
+
+
+def pack_undo(undo: list) -> bytes:
+    """Turns an undo into bytes, which take much less memory than a list. The
+    first byte says whether the numbers are 2 or 4 bytes each."""
+    try:
+        numbers = array(SMALL, undo)
+    except OverflowError:
+        numbers = array(BIG, undo)
+    return numbers.typecode.encode() + numbers.tobytes()
+
+
+def unpack_undo(undo: bytes) -> array:
+    return array(chr(undo[0]), undo[1:])
+
+
+def little_endian(numbers: array) -> array:
+    """Save files always use little-endian numbers, whatever the computer uses."""
+    if sys.byteorder == "big":
+        numbers = array(numbers.typecode, numbers)
+        numbers.byteswap()
+    return numbers
+
+
+def read_numbers(data: bytes, offset: int, typecode: str, count: int):
+    if typecode not in (SMALL, BIG):
+        raise ValueError("bad number type in saved game")
+    numbers = array(typecode)
+    end = offset + count * numbers.itemsize
+    if end > len(data):
+        raise struct.error("saved game is cut short")
+    numbers.frombytes(data[offset:end])
+    return little_endian(numbers), end
@@ -0,0 +1,249 @@
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import time
+import pygame
+from typing import Dict, List
+
+
+ROBOT_DIR = "assets/robot"
+# Decoded robot pixels are saved here so we don't have to decode the PNGs
+# every time the game starts. Run `python sprites.py` to build it.
+ROBOT_CACHE = "assets/robot.cache"
+
+# Each animation is a list of image files, in the order they are played.
+ROBOT_ANIMATIONS = {
+    "idle": ["character_robot_idle.png"],
+    "jump_right": ["character_robot_jump.png"],
+    "walk_right": [
+        "character_robot_walk0.png",
+        "character_robot_walk1.png",
+        "character_robot_walk2.png",
+        "character_robot_walk3.png",
+        "character_robot_walk4.png",
+        "character_robot_walk5.png",
+        "character_robot_walk6.png",
+        "character_robot_walk7.png",
+    ],
+}
+
+# Left-facing animations are just flipped versions of the right-facing ones.
+ROBOT_FLIPPED_ANIMATIONS = {
+    "jump_left": "jump_right",
+    "walk_left": "walk_right",
+}
+
+
+# A SpriteAtlas holds every frame of every animation in one big image, one
+# animation per row. Each frame we hand out is a subsurface: a window onto the
+# big image that shares its pixels instead of having its own copy.
+class SpriteAtlas:
+    def __init__(self, surface: pygame.Surface, areas: Dict[str, List[pygame.Rect]],
+                 buffer=None):
+        # The raw pixels the surface was made from, if it was read from the
+        # cache file. They have to stay around as long as the surface uses them.
+        self.buffer = buffer
+        self.areas = areas
+
+        # Converting to the display's pixel format means blits don't have to
+        # convert every pixel each time the sprite is drawn. This only works
+        # once the display has been created.
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert_alpha()
+            self.buffer = None
+        self.surface = surface
+        self.animations = {}
+        for name, rects in areas.items():
+            self.animations[name] = [surface.subsurface(rect) for rect in rects]
+        # Smaller or bigger copies of this atlas, made by scaled()
+        self.scaled_atlases = {}
+
+    def frame(self, name: str, index: int = 0) -> pygame.Surface:
+        return self.animations[name][index]
+
+    def frames(self, name: str) -> List[pygame.Surface]:
+        return self.animations[name]
+
+    def scaled(self, scale: float) -> "SpriteAtlas":
+        """Returns a copy of the atlas with every frame resized by scale. Each
+        scale is only made once, then kept for next time."""
+        if scale == 1:
+            return self
+        atlas = self.scaled_atlases.get(scale)
+        if atlas is None:
+            # Frames are scaled one at a time so that smoothing doesn't
+            # blend in pixels from the frame next to them.
+            animations = {}
+            for name, frames in self.animations.items():
+                animations[name] = [scale_image(frame, scale) for frame in frames]
+            atlas = SpriteAtlas(*pack_atlas(animations))
+            self.scaled_atlases[scale] = atlas
+        return atlas
+
+
+def scale_image(image: pygame.Surface, scale: float) -> pygame.Surface:
+    width = max(1, int(image.get_width() * scale))
+    height = max(1, int(image.get_height() * scale))
+    return pygame.transform.smoothscale(image, (width, height))
+
+
+def pack_atlas(animations: Dict[str, List[pygame.Surface]]):
+    """Copies all the frames into one image. Returns the image and where each frame is."""
+    width = 0
+    height = 0
+    for frames in animations.values():
+        width = max(width, sum(frame.get_width() for frame in frames))
+        height = height + max(frame.get_height() for frame in frames)
+
+    surface = pygame.Surface((width, height), pygame.SRCALPHA)
+    areas = {}
+    y = 0
+    for name, frames in animations.items():
+        x = 0
+        areas[name] = []
+        for frame in frames:
+            surface.blit(frame, (x, y))
+            areas[name].append(pygame.Rect(x, y, frame.get_width(), frame.get_height()))
+            x = x + frame.get_width()
+        y = y + max(frame.get_height() for frame in frames)
+    return surface, areas
+
+
+def load_animations(directory: str, animations: Dict[str, List[str]],
+                    flipped: Dict[str, str]) -> Dict[str, List[pygame.Surface]]:
+    frames = {}
+    for name, files in animations.items():
+        frames[name] = [pygame.image.load(directory + "/" + file) for file in files]
+    for name, source in flipped.items():
+        frames[name] = [pygame.transform.flip(img, True, False) for img in frames[source]]
+    return frames
+
+
+# The cache file is a small header followed by the atlas pixels:
+#   magic, version, sha256 of the PNG files, atlas width and height,
+#   number of animations, then for each animation its name and frame rects.
+CACHE_MAGIC = b"ATLS"
+CACHE_VERSION = 1
+CACHE_HEADER = struct.Struct("<4sI32sIII")
+CACHE_NAME = struct.Struct("<HH")
+CACHE_RECT = struct.Struct("<iiii")
+
+
+def source_digest(directory: str, animations: Dict[str, List[str]]) -> bytes:
+    """Hashes the PNG files so we can tell when the cache is out of date."""
+    digest = hashlib.sha256()
+    for name, files in animations.items():
+        for file in files:
+            digest.update(file.encode())
+            with open(directory + "/" + file, "rb") as f:
+                digest.update(f.read())
+    return digest.digest()
+
+
+def write_atlas_cache(path: str, digest: bytes, surface: pygame.Surface,
+                      areas: Dict[str, List[pygame.Rect]]):
+    width, height = surface.get_size()
+    # Write to a temporary file first and then swap it in, so a game that is
+    # closed halfway through writing never leaves half a cache behind
+    temp_path = path + ".tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, digest, width, height, len(areas)))
+            for name, rects in areas.items():
+                encoded = name.encode()
+                f.write(CACHE_NAME.pack(len(encoded), len(rects)))
+                f.write(encoded)
+                for rect in rects:
+                    f.write(CACHE_RECT.pack(rect.x, rect.y, rect.width, rect.height))
+            f.write(pygame.image.tobytes(surface, "RGBA"))
+        os.replace(temp_path, path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def read_atlas_cache(path: str, digest: bytes):
+    """Returns an atlas made straight from the cached pixels, or None if the
+    cache is missing, broken or was made from different PNG files."""
+    try:
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        return parse_atlas_cache(buffer, digest)
+    except (struct.error, UnicodeDecodeError, ValueError, pygame.error):
+        # Cut short or scrambled, so it gets rebuilt from the PNGs
+        return None
+
+
+def parse_atlas_cache(buffer, digest: bytes):
+    magic, version, cached_digest, width, height, count = CACHE_HEADER.unpack_from(buffer, 0)
+    if magic != CACHE_MAGIC or version != CACHE_VERSION or cached_digest != digest:
+        return None
+
+    offset = CACHE_HEADER.size
+    areas = {}
+    for i in range(count):
+        name_length, frame_count = CACHE_NAME.unpack_from(buffer, offset)
+        offset = offset + CACHE_NAME.size
+        name = buffer[offset:offset + name_length].decode()
+        offset = offset + name_length
+        areas[name] = []
+        for j in range(frame_count):
+            areas[name].append(pygame.Rect(CACHE_RECT.unpack_from(buffer, offset)))
+            offset = offset + CACHE_RECT.size
+
+    pixels = memoryview(buffer)[offset:offset + width * height * 4]
+    if len(pixels) != width * height * 4:
+        return None
+    surface = pygame.image.frombuffer(pixels, (width, height), "RGBA")
+    # A frame outside the atlas makes subsurface raise ValueError
+    return SpriteAtlas(surface, areas, pixels)
+
+
+def build_atlas(directory: str, animations: Dict[str, List[str]],
+                flipped: Dict[str, str], cache_path: str) -> SpriteAtlas:
+    """Loads an atlas from the cache, decoding the PNGs and rebuilding the
+    cache only if it is missing or out of date."""
+    digest = source_digest(directory, animations)
+    atlas = read_atlas_cache(cache_path, digest)
+    if atlas is not None:
+        return atlas
+    surface, areas = pack_atlas(load_animations(directory, animations, flipped))
+    try:
+        write_atlas_cache(cache_path, digest, surface, areas)
+    except OSError:
+        # We can still play without a cache, it just starts up slower.
+        pass
+    return SpriteAtlas(surface, areas)
+
+
+def load_robot_atlas() -> SpriteAtlas:
+    """Loads the robot images into an atlas. Create the display first."""
+    return build_atlas(ROBOT_DIR, ROBOT_ANIMATIONS, ROBOT_FLIPPED_ANIMATIONS, ROBOT_CACHE)
+
+
+# Running this file builds the robot cache and shows how long loading takes
+# with and without it.
+if __name__ == "__main__":
+    pygame.init()
+    pygame.display.set_mode((1, 1))
+
+    start = time.perf_counter()
+    surface, areas = pack_atlas(load_animations(ROBOT_DIR, ROBOT_ANIMATIONS, ROBOT_FLIPPED_ANIMATIONS))
+    SpriteAtlas(surface, areas)
+    decode_time = time.perf_counter() - start
+    write_atlas_cache(ROBOT_CACHE, source_digest(ROBOT_DIR, ROBOT_ANIMATIONS), surface, areas)
+
+    start = time.perf_counter()
+    if read_atlas_cache(ROBOT_CACHE, source_digest(ROBOT_DIR, ROBOT_ANIMATIONS)) is None:
+        sys.exit("Could not read back " + ROBOT_CACHE)
+    cache_time = time.perf_counter() - start
+
+    print("Wrote " + ROBOT_CACHE)
+    print("Decoding PNGs: %.1f ms" % (decode_time * 1000))
+    print("Reading cache: %.1f ms" % (cache_time * 1000))
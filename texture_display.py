@@ -0,0 +1,115 @@
+import pygame
+import sprites
+from camera import Camera
+from frame_timer import FrameTimer
+
+try:
+    from pygame._sdl2 import sdl2, video
+except ImportError:
+    # Older versions of pygame don't have the texture renderer
+    video = None
+
+
+# A TextureDisplay can be used instead of a Display. Instead of drawing pixels
+# ourselves, it hands textures (images that SDL keeps ready to draw, on the
+# graphics card if there is one) to an SDL Renderer. The robot images and one
+# texture per block color are made once, then everything drawn in a frame is
+# queued up and sent in render(), grouped by texture so SDL can batch them.
+# Without a graphics card SDL's software renderer is used instead.
+class TextureDisplay:
+    WHITE = (255, 255, 255)
+    # Things in lower layers are drawn first
+    BACKGROUND_LAYER = 0
+    SHAPE_LAYER = 1
+    SPRITE_LAYER = 2
+    OVERLAY_LAYER = 3
+
+    def __init__(self, fullscreen=False):
+        self.width = 1200
+        self.height = 800
+        self.scale = 1
+        self.window = video.Window("Robot!", (self.width, self.height), fullscreen_desktop=fullscreen)
+        try:
+            self.renderer = video.Renderer(self.window, accelerated=1)
+        except sdl2.error:
+            self.renderer = video.Renderer(self.window, accelerated=0)
+        # We always draw in game pixels and SDL stretches that to the window
+        self.renderer.logical_size = (self.width, self.height)
+        self.camera = Camera(self.width, self.height)
+        # Maps each image to the texture it lives in and where in the texture
+        self.sprite_areas = {}
+        self.color_textures = {}
+        self.overlay = None
+        self.overlay_texture = None
+        self.queue = []
+
+    def use_sprites(self, atlas: sprites.SpriteAtlas):
+        """Uploads the whole atlas as one texture."""
+        texture = video.Texture.from_surface(self.renderer, atlas.surface)
+        for name, rects in atlas.areas.items():
+            for frame, rect in zip(atlas.frames(name), rects):
+                self.sprite_areas[frame] = (texture, rect)
+
+    def image_texture(self, image: pygame.Surface):
+        area = self.sprite_areas.get(image)
+        if area is None:
+            area = (video.Texture.from_surface(self.renderer, image), image.get_rect())
+            self.sprite_areas[image] = area
+        return area
+
+    def color_texture(self, color):
+        texture = self.color_textures.get(color)
+        if texture is None:
+            pixel = pygame.Surface((1, 1))
+            pixel.fill(color)
+            texture = video.Texture.from_surface(self.renderer, pixel)
+            self.color_textures[color] = texture
+        return texture
+
+    def submit(self, layer: int, texture, area, rect: pygame.Rect):
+        self.queue.append((layer, id(texture), len(self.queue), texture, area, rect))
+
+    def clear(self):
+        self.queue = []
+
+    def draw_background(self, level):
+        view = self.camera.rect
+        for block in level.index.query(view, dynamic=False):
+            self.submit(self.BACKGROUND_LAYER, self.color_texture(block.color), None,
+                        block.rect.move(-view.x, -view.y))
+
+    def is_visible(self, rect: pygame.Rect) -> bool:
+        return rect.colliderect((0, 0, self.width, self.height))
+
+    def fill_rect(self, color, rect: pygame.Rect) -> pygame.Rect:
+        self.submit(self.SHAPE_LAYER, self.color_texture(color), None, rect.copy())
+        return rect
+
+    def draw_image(self, image: pygame.Surface, rect: pygame.Rect) -> pygame.Rect:
+        texture, area = self.image_texture(image)
+        self.submit(self.SPRITE_LAYER, texture, area, pygame.Rect(rect.topleft, area.size))
+        return rect
+
+    def draw_overlay(self, timer: FrameTimer):
+        overlay = timer.overlay_image()
+        if overlay is None:
+            return
+        # The timer makes a new image whenever the numbers change
+        if overlay is not self.overlay:
+            self.overlay = overlay
+            self.overlay_texture = video.Texture.from_surface(self.renderer, overlay)
+        self.submit(self.OVERLAY_LAYER, self.overlay_texture, None, overlay.get_rect())
+
+    def mark_dirty(self, item, rect: pygame.Rect):
+        # The whole window is drawn every frame, so there's nothing to remember
+        pass
+
+    def render(self):
+        renderer = self.renderer
+        renderer.draw_color = self.WHITE + (255,)
+        renderer.clear()
+        self.queue.sort(key=lambda draw: draw[:3])
+        for layer, texture_id, order, texture, area, rect in self.queue:
+            texture.draw(area, rect)
+        renderer.present()
+        self.queue = []
@@ -0,0 +1,155 @@
+import json
+import pygame
+from typing import Dict, List, Tuple
+
+
+TILE_SIZE = 20
+EMPTY = "."
+# The tile a platform is colored like if it doesn't say
+PLATFORM_TILE = "B"
+# Which color each kind of tile is drawn with
+DEFAULT_LEGEND = {
+    "#": (165, 42, 42),
+    "B": (0, 0, 255),
+}
+
+
+# A TileMap is a level drawn as a grid of characters, one per tile:
+#
+#   ..........
+#   ...BBB....
+#   ##########
+#
+# Every non-empty character is a solid tile. Editing the grid is easy, but
+# one rect per tile would mean lots of rects to check and draw, so
+# merged_rects() joins neighbouring tiles of the same kind into as few big
+# rectangles as it can.
+#
+# Platforms that move aren't part of the grid. Each one is a dict, with its
+# position, size and path counted in tiles:
+#
+#   {"at": [10, 30], "width": 4, "path": [[10, 30], [20, 30]], "speed": 2}
+#   {"at": [40, 25], "width": 3, "falls": true}
+#
+# The first goes back and forth along its path at speed pixels per step. The
+# second falls when someone stands on it. "tile" picks the color from the
+# legend and "height" defaults to one tile.
+class TileMap:
+    def __init__(self, rows: List[str], tile_size: int = TILE_SIZE,
+                 legend: Dict[str, Tuple[int, int, int]] = None, platforms: List[dict] = None):
+        width = max(len(row) for row in rows) if len(rows) > 0 else 0
+        # Short rows are padded with empty tiles so every row has the same length
+        self.grid = [list(row.ljust(width, EMPTY)) for row in rows]
+        self.tile_size = tile_size
+        self.legend = dict(DEFAULT_LEGEND if legend is None else legend)
+        self.columns = width
+        self.rows = len(rows)
+        self.platforms = [] if platforms is None else list(platforms)
+        # Goes up each time a tile changes, like Level.version
+        self.version = 0
+
+    @property
+    def width(self):
+        return self.columns * self.tile_size
+
+    @property
+    def height(self):
+        return self.rows * self.tile_size
+
+    def get(self, column: int, row: int) -> str:
+        return self.grid[row][column]
+
+    def set(self, column: int, row: int, tile: str):
+        if self.grid[row][column] != tile:
+            self.grid[row][column] = tile
+            self.version = self.version + 1
+
+    def check(self):
+        """Raises ValueError if the level uses something it doesn't have,
+        like a tile that isn't in the legend or a moving platform without a
+        path. Columns and rows count from 0, like a platform's "at"."""
+        for row in range(self.rows):
+            for column in range(self.columns):
+                tile = self.grid[row][column]
+                if tile != EMPTY and tile not in self.legend:
+                    raise ValueError("tile %r at column %d, row %d isn't in the legend"
+                                     % (tile, column, row))
+        for number, platform in enumerate(self.platforms):
+            if "at" not in platform:
+                raise ValueError("platform %d has no \"at\"" % number)
+            column, row = platform["at"]
+            where = "the platform at column %d, row %d" % (column, row)
+            tile = platform.get("tile", PLATFORM_TILE)
+            if tile not in self.legend:
+                raise ValueError("%s uses tile %r, which isn't in the legend" % (where, tile))
+            if not platform.get("falls", False) and "path" not in platform:
+                raise ValueError("%s needs a \"path\" to move along, or \"falls\": true" % where)
+
+    def merged_rects(self):
+        """Returns a list of (rect, tile) that covers every solid tile.
+
+        Works greedily: starting from the top left, take the first tile that
+        isn't covered yet, stretch it right as far as the same tile goes,
+        then stretch that whole strip down as far as every tile under it
+        matches too."""
+        covered = [[False] * self.columns for row in range(self.rows)]
+        size = self.tile_size
+        rects = []
+        for row in range(self.rows):
+            for column in range(self.columns):
+                tile = self.grid[row][column]
+                if tile == EMPTY or covered[row][column]:
+                    continue
+                end_column = column + 1
+                while (end_column < self.columns and self.grid[row][end_column] == tile
+                       and not covered[row][end_column]):
+                    end_column = end_column + 1
+                end_row = row + 1
+                while end_row < self.rows and all(
+                        self.grid[end_row][c] == tile and not covered[end_row][c]
+                        for c in range(column, end_column)):
+                    end_row = end_row + 1
+                for r in range(row, end_row):
+                    for c in range(column, end_column):
+                        covered[r][c] = True
+                rects.append((pygame.Rect(column * size, row * size,
+                                          (end_column - column) * size, (end_row - row) * size),
+                              tile))
+        return rects
+
+    def save(self, path: str):
+        # Written by hand instead of with json.dump(indent=...) so that each
+        # row of the grid stays on its own line and the file looks like the level.
+        legend = {tile: list(color) for tile, color in self.legend.items()}
+        rows = ",\n".join("    " + json.dumps("".join(row)) for row in self.grid)
+        with open(path, "w") as f:
+            f.write("{\n")
+            f.write('  "tile_size": %d,\n' % self.tile_size)
+            f.write('  "legend": %s,\n' % json.dumps(legend))
+            if len(self.platforms) > 0:
+                platforms = ",\n".join("    " + json.dumps(platform) for platform in self.platforms)
+                f.write('  "platforms": [\n%s\n  ],\n' % platforms)
+            f.write('  "rows": [\n%s\n  ]\n' % rows)
+            f.write("}\n")
+
+
+def load(path: str) -> TileMap:
+    """Loads a level file. It is JSON with a "rows" list of strings and an
+    optional "tile_size", "legend" of tile character to [r, g, b] and
+    "platforms" list. Raises ValueError if the level doesn't make sense."""
+    with open(path) as f:
+        try:
+            data = json.load(f)
+        except ValueError as error:
+            raise ValueError("%s isn't a JSON file: %s" % (path, error))
+    if "rows" not in data:
+        raise ValueError(path + ": there is no \"rows\" list in it")
+    legend = None
+    if "legend" in data:
+        legend = {tile: tuple(color) for tile, color in data["legend"].items()}
+    tiles = TileMap(data["rows"], data.get("tile_size", TILE_SIZE), legend, data.get("platforms"))
+    try:
+        tiles.check()
+    except ValueError as error:
+        raise ValueError("%s: %s" % (path, error))
+    return tiles